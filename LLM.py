@@ -1,65 +1,179 @@
 from flask import Flask, request, jsonify, Response
-import requests, os, subprocess, time, json, threading, re
+import requests, os, subprocess, time, json, threading, re, atexit, hashlib, socket
 from pathlib import Path
 from datetime import datetime
+from collections import OrderedDict
+from itertools import islice
+from contextlib import contextmanager
+import transport, turn_trace, metrics
+from scheduler import FairScheduler, Busy
 
 app = Flask(__name__)
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
 OLLAMA_BIN = os.getenv("OLLAMA_BIN", "ollama")
 MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+OLLAMA_TAGS_URL = os.getenv("OLLAMA_TAGS_URL", OLLAMA_URL.split("/api/")[0] + "/api/tags")
+
+HTTP = transport.make_session(pool_size=int(os.getenv("LLM_HTTP_POOL", "8")))
+OLLAMA_HEALTH = transport.HealthMonitor(OLLAMA_TAGS_URL, interval=float(os.getenv("OLLAMA_HEALTH_INTERVAL", "5")))
 
 MAX_TURNS_PER_SESSION = int(os.getenv("LLM_MAX_TURNS", "10"))
 MEM_DIR = Path(os.getenv("LLM_MEM_DIR", "memory")); MEM_DIR.mkdir(parents=True, exist_ok=True)
+SESSION_CACHE_MAX = int(os.getenv("LLM_SESSION_CACHE_MAX", "256"))
+SESSION_CACHE_BYTES = int(float(os.getenv("LLM_SESSION_CACHE_MB", "32")) * 1024 * 1024)
+SESSION_TTL = float(os.getenv("LLM_SESSION_TTL", "3600"))
+PAGE_SIZE = int(os.getenv("LLM_PAGE_SIZE", "100"))
+
+HOST = os.getenv("LLM_HOST", "0.0.0.0")
+PORT = int(os.getenv("LLM_PORT", "5000"))
+SERVER = os.getenv("LLM_SERVER", "waitress")  # "waitress" (threaded WSGI pool) or "flask"
+THREADS = int(os.getenv("LLM_THREADS", "16"))
+
+SCHED = FairScheduler(limit=int(os.getenv("OLLAMA_CONCURRENCY", "1")),
+                      max_queue=int(os.getenv("OLLAMA_QUEUE_MAX", "8")),
+                      deadline=float(os.getenv("OLLAMA_QUEUE_DEADLINE", "20")))
+
+M_REQUEST = metrics.Histogram("bjoern_llm_request_seconds", "Time to answer /talk and /talk_stream.",
+                              (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60), ("route", "outcome"))
+M_TOKENS_PER_S = metrics.Histogram("bjoern_ollama_eval_tokens_per_second", "Ollama generation speed (eval_count / eval_duration).",
+                                   (1, 2, 4, 6, 8, 10, 15, 20, 30, 50, 100))
+M_PROMPT_EVAL = metrics.Histogram("bjoern_ollama_prompt_eval_seconds", "Ollama prompt evaluation time.",
+                                  (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+M_LOAD = metrics.Histogram("bjoern_ollama_load_seconds", "Ollama model load time reported with a reply.", (0.01, 0.1, 1, 5, 15, 60))
+M_EVAL_TOKENS = metrics.Counter("bjoern_ollama_eval_tokens_total", "Tokens generated by Ollama.")
+M_PROMPT_TOKENS = metrics.Counter("bjoern_ollama_prompt_eval_tokens_total", "Prompt tokens evaluated by Ollama.")
+M_REFUSALS = metrics.Counter("bjoern_llm_refusals_total", "Turns answered with the blocklist refusal.", ("language", "stage"))
+M_OLLAMA_RESTARTS = metrics.Counter("bjoern_ollama_restarts_total", "Times ensure_ollama_running() started `ollama serve`.")
 
-SESSIONS = {}
+STORE = os.getenv("LLM_STORE", "jsonl")  # "jsonl" (one file per session) or "sqlite"
+DB = None
+if STORE == "sqlite":
+    import session_store
+    DB = session_store.SqliteStore(os.getenv("LLM_SQLITE_PATH", str(MEM_DIR / "sessions.db")))
+    atexit.register(DB.flush)
+
+SPECULATE = os.getenv("LLM_SPECULATE", "1") == "1"
+PREFETCH_QUIET_S = float(os.getenv("LLM_PREFETCH_QUIET", "2"))  # /prefetch ignored this long after a turn
+REUSE_CONTEXT = os.getenv("LLM_REUSE_CONTEXT", "1") == "1"
+MAX_CONTEXT_TOKENS = int(os.getenv("LLM_MAX_CONTEXT_TOKENS", "3072"))
+REPLY_CACHE_ON = os.getenv("LLM_REPLY_CACHE", "0") == "1"
+REPLY_CACHE_MAX = int(os.getenv("LLM_REPLY_CACHE_MAX", "512"))
+REPLY_CACHE_TTL = float(os.getenv("LLM_REPLY_CACHE_TTL", "86400"))
+
+SESSIONS = OrderedDict()  # LRU order: least recently used first
+SESSION_LAST_USE = {}
+SESSION_SIZES = {}  # session id -> _approx_bytes of its cached history
+SESSION_BYTES = 0   # sum of SESSION_SIZES
 NAMES = {}
 NAME_LAST_USE = {}
-LOCK = threading.Lock()
+SPECULATIONS = {}
+CONTEXTS = {}
+SESSION_LOCKS = {}
+TURN_ENDED = {}
+REPLY_CACHE = OrderedDict()  # (text, lang, persona hash) -> (reply, stored_at), LRU order
+REPLY_CACHE_STATS = {"hits": 0, "misses": 0}
+LOCK = threading.Lock()  # guards the dicts above; never held across I/O
 
 REFUSAL_EN = "I can’t talk about that. Let’s choose a safe topic—space, animals, or a riddle?"
 REFUSAL_DE = "Darüber kann ich nicht sprechen. Lass uns etwas Sicheres wählen: Weltraum, Tiere oder ein Rätsel?"
+BUSY_EN = "I'm thinking about lots of things right now. Can you ask me again in a moment?"
+BUSY_DE = "Ich denke gerade über ganz viel nach. Frag mich gleich noch einmal!"
 BLOCKLIST = ["suicide","self harm","kill myself","sex","porn","nsfw","nude","drugs","cocaine","meth","heroin",
              "weapon","gun","bomb","bleeding","gore","murder","suicide pact","how to make","explosive","pedo",
              "alcohol","strip club","fetish","rape","abuse","violence","steal","shoplift","hack","ddos","virus"]
+BLOCKLIST_DE = ["selbstmord","suizid","umbringen","ritzen","porno","nackt","drogen","kokain","waffe","pistole",
+                "gewehr","bombe","mord","sprengstoff","alkohol","schnaps","vergewaltigung","missbrauch","gewalt",
+                "stehlen","klauen","hacken"]
 
 def ensure_ollama_running():
+    OLLAMA_HEALTH.start()
+    if OLLAMA_HEALTH.alive or OLLAMA_HEALTH.check(): return True
     try:
-        requests.get("http://localhost:11434/api/tags", timeout=1); return True
-    except requests.exceptions.RequestException:
-        try:
-            subprocess.Popen([OLLAMA_BIN, "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            for _ in range(15):
-                try:
-                    requests.get("http://localhost:11434/api/tags", timeout=1); return True
-                except requests.exceptions.RequestException: time.sleep(1)
-            return False
-        except Exception: return False
-
-def _load_session_from_disk(session_id):
+        subprocess.Popen([OLLAMA_BIN, "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        M_OLLAMA_RESTARTS.inc()
+        for _ in range(15):
+            if OLLAMA_HEALTH.check(): return True
+            time.sleep(1)
+        return False
+    except Exception: return False
+
+def _ollama_post(payload, stream=False):
+    try:
+        return HTTP.post(OLLAMA_URL, json=payload, stream=stream, timeout=120)
+    except requests.exceptions.ConnectionError:
+        OLLAMA_HEALTH.mark_down(); raise
+
+def _tail_lines(path, n, block=8192):
+    # Reads backwards from the end of the file until it holds n complete lines.
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END); pos = f.tell(); data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block, pos); pos -= step
+            f.seek(pos); data = f.read(step) + data
+    return data.splitlines()[-n:]
+
+def _load_session_from_disk(session_id, limit=None):
+    if DB: return DB.load_tail(session_id, limit or MAX_TURNS_PER_SESSION * 2)
     p = MEM_DIR / f"session_{session_id}.jsonl"
     if not p.exists(): return []
     items = []
     try:
-        with p.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line: items.append(json.loads(line))
+        for line in _tail_lines(p, limit or MAX_TURNS_PER_SESSION * 2):
+            line = line.strip()
+            if not line: continue
+            try: items.append(json.loads(line))
+            except ValueError: pass
     except Exception: pass
     return items
 
 def _append_to_disk(session_id, item):
+    if DB: DB.append(session_id, item); return
     p = MEM_DIR / f"session_{session_id}.jsonl"
     try:
         with p.open("a", encoding="utf-8") as f:
             f.write(json.dumps(item, ensure_ascii=False) + "\n")
     except Exception: pass
 
+def _approx_bytes(history):
+    return sum(240 + len(t.get("content") or "") for t in history)
+
+def _resize_session(session_id, history):
+    # Caller holds LOCK. Updates the running byte total after a cached history changed; a history
+    # that was evicted while a turn still held it no longer counts.
+    global SESSION_BYTES
+    if SESSIONS.get(session_id) is not history: return
+    size = _approx_bytes(history)
+    SESSION_BYTES += size - SESSION_SIZES.get(session_id, 0); SESSION_SIZES[session_id] = size
+
+def _forget_session(session_id):
+    global SESSION_BYTES
+    SESSIONS.pop(session_id, None); SESSION_LAST_USE.pop(session_id, None)
+    SESSION_BYTES -= SESSION_SIZES.pop(session_id, 0)
+    NAMES.pop(session_id, None); NAME_LAST_USE.pop(session_id, None); CONTEXTS.pop(session_id, None)
+    TURN_ENDED.pop(session_id, None)
+    spec = SPECULATIONS.pop(session_id, None)
+    if spec: spec.cancel()
+
+def _evict_sessions(now):
+    # Caller holds LOCK. Drops least recently used sessions while the cache is over its count or
+    # size cap, or they have been idle longer than SESSION_TTL; they reload from disk on next use.
+    while len(SESSIONS) > 1:
+        sid = next(iter(SESSIONS))
+        if (len(SESSIONS) <= SESSION_CACHE_MAX and SESSION_BYTES <= SESSION_CACHE_BYTES
+                and now - SESSION_LAST_USE.get(sid, now) < SESSION_TTL): break
+        _forget_session(sid)
+
 def _get_session(session_id):
+    with LOCK: cached = SESSIONS.get(session_id)
+    loaded = _load_session_from_disk(session_id) if cached is None else None
     with LOCK:
-        if session_id not in SESSIONS:
-            SESSIONS[session_id] = _load_session_from_disk(session_id)
-        return SESSIONS[session_id]
+        history = SESSIONS.setdefault(session_id, cached if cached is not None else loaded)
+        SESSIONS.move_to_end(session_id)
+        if session_id not in SESSION_SIZES: _resize_session(session_id, history)
+        now = time.time(); SESSION_LAST_USE[session_id] = now
+        _evict_sessions(now)
+        return history
 
 def _persona(language, user_name):
     name_hint = f" The child's name is {user_name}. Use the name at most once occasionally." if user_name else ""
@@ -75,15 +189,79 @@ def _persona(language, user_name):
             "Do not start every sentence with a greeting. "
             f"{name_hint} Reply only in English.\n\nConversation:\n")
 
-def _blocked(t):
-    t = (t or "").lower()
-    return any(w in t for w in BLOCKLIST)
+# Ordinary words that start with a blocked stem ("method", "Nudeln", "Waffeln").
+BLOCK_ALLOW = ["method","methan","nudel","waffel","gewaltig","hackfleisch","nacktschnecke"]
+
+def _stem_pattern(words):
+    # Stems match as prefixes ("rape" blocks "raped", "alcohol" "alcoholic"), factored into a trie
+    # so every branch starts with a literal.
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w: node = node.setdefault(ch, {})
+        node[""] = {}
+    def emit(node, prefix):
+        if "" in node:  # a whole stem: whatever follows matches too, except an allowlisted word
+            rests = sorted(re.escape(a[len(prefix):]) for a in BLOCK_ALLOW if a.startswith(prefix) and a != prefix)
+            return f"(?!{'|'.join(rests)})" if rests else ""
+        parts = [(r"\s+" if ch == " " else re.escape(ch)) + emit(node[ch], prefix + ch) for ch in sorted(node)]
+        return parts[0] if len(parts) == 1 else "(?:" + "|".join(parts) + ")"
+    return emit(trie, "")
+
+def _compile_blocklist(words, compound_words=()):
+    # `words` must start a word ("gun" passes "begun"); compound_words are also found inside other
+    # words (German "Atombombe", "Handfeuerwaffe"). Patterns are lowercase and the word start is a
+    # plain character class rather than \b: both keep the first position a charset the engine can
+    # skip ahead on, which re.I and \b would disable. Callers lowercase the text and prefix a space.
+    alts = []
+    if words: alts.append("[^a-z0-9_]" + _stem_pattern(sorted(set(words))))
+    if compound_words: alts.append(_stem_pattern(sorted(set(compound_words))))
+    return re.compile("|".join(alts))
+
+BLOCK_RE = {"en": _compile_blocklist(BLOCKLIST), "de": _compile_blocklist(BLOCKLIST, BLOCKLIST_DE)}
+_BLOCK_OVERLAP = max(len(w) for w in BLOCKLIST + BLOCKLIST_DE) + 8
+
+def _blocklist(language):
+    return BLOCK_RE["de"] if (language or "").startswith("de") else BLOCK_RE["en"]
+
+def _blocked(t, language="en"):
+    return bool(t) and _blocklist(language).search(" " + t.lower()) is not None
+
+def _refusal(language):
+    return REFUSAL_DE if (language or "").startswith("de") else REFUSAL_EN
+
+def _busy(language):
+    return BUSY_DE if (language or "").startswith("de") else BUSY_EN
 
 def _safety_wrap(language, user_text, reply):
-    if _blocked(user_text) or _blocked(reply):
-        return REFUSAL_DE if (language or "").startswith("de") else REFUSAL_EN
+    if _blocked(user_text, language) or _blocked(reply, language):
+        return _refusal(language)
     return reply.strip()
 
+class _Scanner:
+    # Incremental blocklist scan of a streamed reply. Only text up to the last non-word character
+    # is searched, so a word split across tokens is judged once complete, and each feed() rescans
+    # just a short overlap instead of the whole reply.
+    def __init__(self, language):
+        self.rx = _blocklist(language); self.buf = " "; self.pos = 0; self.hit = False
+
+    def _scan(self, end):
+        if self.rx.search(self.buf, max(0, self.pos - _BLOCK_OVERLAP), end): self.hit = True
+        self.pos = end
+        if len(self.buf) > 4 * _BLOCK_OVERLAP:
+            cut = self.pos - _BLOCK_OVERLAP
+            self.buf = self.buf[cut:]; self.pos -= cut
+        return self.hit
+
+    def feed(self, chunk):
+        self.buf += chunk.lower()
+        end = len(self.buf)
+        while end > self.pos and (self.buf[end - 1].isalnum() or self.buf[end - 1] == "_"): end -= 1
+        return self.hit or (end > self.pos and self._scan(end))
+
+    def finish(self):
+        return self.hit or self._scan(len(self.buf))
+
 def _build_prompt(history, user_text, language, user_name):
     parts = [_persona(language, user_name)]
     recent = history[-MAX_TURNS_PER_SESSION:]
@@ -94,74 +272,488 @@ def _build_prompt(history, user_text, language, user_name):
     parts.append(f"User: {user_text.strip()}\nAssistant:")
     return "".join(parts)
 
-@app.route("/talk", methods=["POST"])
-def talk():
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»“”)\]]*\s+")
+
+def _split_sentences(buf):
+    out, pos = [], 0
+    for m in _SENTENCE_END.finditer(buf):
+        s = buf[pos:m.end()].strip()
+        if s: out.append(s)
+        pos = m.end()
+    return out, buf[pos:]
+
+def _sentences(text):
+    out, rest = _split_sentences(text + " ")
+    return out + ([rest.strip()] if rest.strip() else [])
+
+# Follow-ups like "tell me another one" or "why is that?" depend on earlier turns.
+_CONTEXT_WORDS = re.compile(r"\b(it|that|this|they|them|he|she|again|another|more|else|"
+                            r"es|das|dies|sie|er|nochmal|noch|anderes?|mehr)\b", re.I)
+
+def _reply_cache_key(user_text, language, user_name, allowed=True):
+    if not REPLY_CACHE_ON or not allowed or _CONTEXT_WORDS.search(user_text): return None
+    norm = " ".join(re.findall(r"\w+", user_text.lower()))
+    persona = hashlib.sha1((MODEL + _persona(language, user_name)).encode("utf-8")).hexdigest()[:16]
+    return (norm, (language or "en").split("-")[0].lower(), persona)
+
+def _cache_lookup(key):
+    if key is None: return None
+    with LOCK:
+        hit = REPLY_CACHE.get(key)
+        if hit and time.time() - hit[1] < REPLY_CACHE_TTL:
+            REPLY_CACHE.move_to_end(key); REPLY_CACHE_STATS["hits"] += 1
+            return hit[0]
+        if hit: del REPLY_CACHE[key]
+        REPLY_CACHE_STATS["misses"] += 1
+    return None
+
+def _cache_store(key, reply):
+    if key is None or not reply: return
+    with LOCK:
+        REPLY_CACHE[key] = (reply, time.time()); REPLY_CACHE.move_to_end(key)
+        while len(REPLY_CACHE) > REPLY_CACHE_MAX: REPLY_CACHE.popitem(last=False)
+
+def _context_key(language, user_name, n_history):
+    return (language, user_name, MODEL, OLLAMA_HEALTH.epoch, n_history)
+
+def _generate_payload(session_id, history, user_text, language, user_name):
+    # Continue from the KV context Ollama returned last turn and send only the new user turn.
+    # The saved context is keyed on everything the full prompt depends on, so a trimmed history,
+    # a new language or name, or a restarted Ollama falls back to rebuilding the whole prompt.
+    with LOCK: saved = CONTEXTS.get(session_id)
+    if (REUSE_CONTEXT and saved and saved["key"] == _context_key(language, user_name, len(history))
+            and len(saved["ctx"]) <= MAX_CONTEXT_TOKENS):
+        return {"model": MODEL, "prompt": f"User: {user_text.strip()}\nAssistant:", "context": saved["ctx"]}
+    return {"model": MODEL, "prompt": _build_prompt(history, user_text, language, user_name)}
+
+def _ollama_stream(payload, meta=None, on_response=None):
+    with _ollama_post(dict(payload, stream=True), stream=True) as r:
+        r.raise_for_status()
+        if on_response: on_response(r)
+        for line in r.iter_lines():
+            if not line: continue
+            chunk = json.loads(line)
+            if chunk.get("response"): yield chunk["response"]
+            if chunk.get("done"):
+                if meta is not None: meta.update(chunk)
+                break
+
+def _reply_tokens(payload, spec, scan, meta):
+    # Reply tokens from a confirmed speculation or a fresh Ollama stream. Stops before yielding the
+    # token that completes a blocked word; closing the stream makes Ollama abort the generation.
+    gen = spec.stream() if spec else _ollama_stream(payload, meta)
+    try:
+        for tok in gen:
+            if scan.feed(tok): return
+            yield tok
+    finally:
+        gen.close()
+        if spec: spec.cancel(); meta.update(spec.meta)
+
+class _Speculation:
+    # Generation started from a partial transcript while the child is still talking. Tokens are
+    # buffered so a confirming /talk or /talk_stream can replay them and follow the rest live.
+    def __init__(self, payload, language):
+        self.payload = payload; self.language = language
+        self.tokens = []; self.done = False; self.error = None; self.meta = {}
+        self.cancelled = threading.Event(); self.cond = threading.Condition(); self.response = None
+        self.started = time.time(); self.holds_slot = True  # the caller took a SCHED slot for us
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _attach(self, response):
+        with self.cond: self.response = response
+        if self.cancelled.is_set(): self._abort()
+
+    def _abort(self):
+        # Response.close() from another thread only takes effect once the reader's recv returns,
+        # i.e. at the next token. Shutting the socket down wakes _run now, so it releases the slot
+        # at once, and Ollama sees the disconnect and stops generating.
+        with self.cond: r = self.response
+        try:
+            sock = getattr(r.raw.connection, "sock", None) if r is not None else None
+            if sock is not None: sock.shutdown(socket.SHUT_RDWR)
+        except Exception: pass
+
+    def _run(self):
+        scan = _Scanner(self.language)
+        try:
+            for tok in _ollama_stream(self.payload, self.meta, self._attach):
+                if self.cancelled.is_set(): break
+                if scan.feed(tok): break
+                with self.cond: self.tokens.append(tok); self.cond.notify_all()
+        except Exception as e:
+            if not self.cancelled.is_set(): self.error = e
+        finally:
+            with self.cond:
+                self.done = True; self.response = None; self.cond.notify_all()
+                release, self.holds_slot = self.holds_slot, False
+            if release: SCHED.release(time.time() - self.started)
+
+    def cancel(self):
+        self.cancelled.set(); self._abort()
+
+    def hand_over(self):
+        # Cancels this speculation and passes its scheduler slot on, if it still holds one.
+        self.cancel()
+        with self.cond:
+            had, self.holds_slot = self.holds_slot, False
+        return had
+
+    def stream(self):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.tokens) and not self.done: self.cond.wait()
+                new, done = self.tokens[i:], self.done
+            i += len(new)
+            yield from new
+            if done and i >= len(self.tokens):
+                if self.error: raise self.error
+                return
+
+@contextmanager
+def _generation_slot(session_id, spec, marks=None):
+    # A confirmed speculation already holds its scheduler slot.
+    if spec:
+        if marks is not None: marks["slot"] = time.time()
+        yield; return
+    with SCHED.slot(session_id):
+        if marks is not None: marks["slot"] = time.time()
+        yield
+
+def _observe_turn(route, t_req, now, marks, meta, outcome, language):
+    M_REQUEST.observe(now - t_req, route=route, outcome=outcome)
+    if outcome == "refusal":
+        # Without a scheduler slot nothing was generated, so the child's own words were blocked.
+        M_REFUSALS.inc(language="de" if (language or "").startswith("de") else "en",
+                       stage="reply" if "slot" in marks else "input")
+    ns = 1e-9
+    if meta.get("eval_duration"):
+        M_TOKENS_PER_S.observe(meta.get("eval_count", 0) / (meta["eval_duration"] * ns))
+        M_EVAL_TOKENS.inc(meta.get("eval_count", 0))
+    if meta.get("prompt_eval_duration"):
+        M_PROMPT_EVAL.observe(meta["prompt_eval_duration"] * ns)
+        M_PROMPT_TOKENS.inc(meta.get("prompt_eval_count", 0))
+    if meta.get("load_duration"): M_LOAD.observe(meta["load_duration"] * ns)
+
+def _finish_turn(route, turn, t_req, marks, meta, outcome, language, spec=None):
+    # Metrics and trace spans for one /talk or /talk_stream request. Ollama only reports
+    # durations, so its prompt-eval and eval spans are placed after the slot was granted (and
+    # the model loaded).
+    now = time.time()
+    _observe_turn(route, t_req, now, marks, meta, outcome, language)
+    if not turn: return
+    turn_trace.emit("llm", turn, "request", t_req, now, outcome=outcome, speculated=bool(spec))
+    slot = marks.get("slot")
+    if slot is None: return
+    turn_trace.emit("llm", turn, "queue_wait", t_req, slot)
+    if "first_sentence" in marks: turn_trace.emit("llm", turn, "first_sentence", t_req, marks["first_sentence"])
+    ns = 1e-9
+    t = slot + meta.get("load_duration", 0) * ns
+    if meta.get("prompt_eval_duration"):
+        t1 = t + meta["prompt_eval_duration"] * ns
+        turn_trace.emit("llm", turn, "prompt_eval", t, t1, tokens=meta.get("prompt_eval_count", 0)); t = t1
+    if meta.get("eval_duration"):
+        turn_trace.emit("llm", turn, "eval", t, t + meta["eval_duration"] * ns, tokens=meta.get("eval_count", 0),
+                        tokens_per_s=round(meta.get("eval_count", 0) / (meta["eval_duration"] * ns), 1))
+
+def _take_speculation(session_id, payload):
+    with LOCK: spec = SPECULATIONS.pop(session_id, None)
+    if spec and spec.payload == payload: return spec
+    if spec: spec.cancel()
+    return None
+
+def _turn_request():
     body = request.json or {}
     user_text = (body.get("text") or "").strip()
     language = (body.get("language") or "en").strip()
     session_id = (body.get("session_id") or "default").strip()
     user_name = (body.get("user_name") or "").strip()
-    if not user_text: return jsonify({"error":"Missing text"}), 400
-    if not ensure_ollama_running(): return jsonify({"reply":"Ollama could not be started or reached."}), 503
+    return user_text, language, session_id, user_name
 
+def _session_name(session_id, user_name):
     with LOCK:
         if user_name: NAMES[session_id] = user_name
-    name_for_session = NAMES.get(session_id, "")
+        return NAMES.get(session_id, "")
 
-    history = _get_session(session_id)
-    prompt = _build_prompt(history, user_text, language, name_for_session)
+def _record_turn(session_id, history, language, name_for_session, user_text, raw_reply, reply, context=None):
+    with LOCK:
+        last_use = NAME_LAST_USE.get(session_id, -999)
+        turn_idx = len(history)
+        allow_name = (turn_idx - last_use) >= 6
+    if name_for_session and allow_name and re.search(rf"\b{re.escape(name_for_session)}\b", raw_reply, flags=re.I):
+        with LOCK: NAME_LAST_USE[session_id] = len(history)
 
-    try:
-        r = requests.post(OLLAMA_URL, json={"model": MODEL, "prompt": prompt, "stream": False}, timeout=120)
-        r.raise_for_status()
-        data = r.json()
-        raw_reply = (data.get("response") or "").strip()
+    user_item = {"role":"user","content":user_text,"lang":language,"ts":time.time()}
+    asst_item = {"role":"assistant","content":reply,"lang":language,"ts":time.time()}
+    with LOCK:
+        history.append(user_item); history.append(asst_item)
+        trimmed = len(history) > MAX_TURNS_PER_SESSION * 3
+        if trimmed:
+            del history[: (len(history) - MAX_TURNS_PER_SESSION * 2)]
+        _resize_session(session_id, history)
+        # The context only matches history if Ollama's raw reply is what we stored.
+        if context and not trimmed and reply == raw_reply:
+            CONTEXTS[session_id] = {"ctx": context, "key": _context_key(language, name_for_session, len(history))}
+        else:
+            CONTEXTS.pop(session_id, None)
+    _append_to_disk(session_id, user_item); _append_to_disk(session_id, asst_item)
 
+@contextmanager
+def _session_turn(session_id):
+    # Serializes turns within one session while different sessions run in parallel. Entries are
+    # refcounted so the lock disappears once no request for the session is running or waiting.
+    with LOCK:
+        entry = SESSION_LOCKS.setdefault(session_id, [threading.Lock(), 0]); entry[1] += 1
+    try:
+        with entry[0]: yield
+    finally:
         with LOCK:
-            last_use = NAME_LAST_USE.get(session_id, -999)
-            turn_idx = len(history)
-            allow_name = (turn_idx - last_use) >= 6
-        reply = _safety_wrap(language, user_text, raw_reply)
+            entry[1] -= 1; TURN_ENDED[session_id] = time.time()
+            if entry[1] == 0 and SESSION_LOCKS.get(session_id) is entry: del SESSION_LOCKS[session_id]
 
-        if name_for_session and allow_name and re.search(rf"\b{re.escape(name_for_session)}\b", raw_reply, flags=re.I):
-            with LOCK: NAME_LAST_USE[session_id] = len(history)
+def _answer_without_ollama(session_id, user_text, language, user_name, cache_key):
+    # Blocked input and reply-cache hits skip Ollama entirely. Both still go through
+    # _safety_wrap and into the session history like any generated turn, and end a speculation
+    # from this turn's partials, which would otherwise keep its scheduler slot with no taker.
+    raw_reply = "" if _blocked(user_text, language) else _cache_lookup(cache_key)
+    if raw_reply is None: return None
+    with _session_turn(session_id):
+        with LOCK: spec = SPECULATIONS.pop(session_id, None)
+        if spec: spec.cancel()
+        reply = _safety_wrap(language, user_text, raw_reply)
+        _record_turn(session_id, _get_session(session_id), language, _session_name(session_id, user_name), user_text, raw_reply, reply)
+    return reply
 
-        user_item = {"role":"user","content":user_text,"lang":language,"ts":time.time()}
-        asst_item = {"role":"assistant","content":reply,"lang":language,"ts":time.time()}
-        with LOCK:
-            history.append(user_item); history.append(asst_item)
-            if len(history) > MAX_TURNS_PER_SESSION * 3:
-                del history[: (len(history) - MAX_TURNS_PER_SESSION * 2)]
-        _append_to_disk(session_id, user_item); _append_to_disk(session_id, asst_item)
+@app.route("/talk", methods=["POST"])
+def talk():
+    t_req = time.time()
+    user_text, language, session_id, user_name = _turn_request()
+    if not user_text: return jsonify({"error":"Missing text"}), 400
+    turn = (request.json or {}).get("turn_id")
+    cache_key = _reply_cache_key(user_text, language, _session_name(session_id, user_name), (request.json or {}).get("cache", True))
+    reply = _answer_without_ollama(session_id, user_text, language, user_name, cache_key)
+    if reply is not None:
+        _finish_turn("talk", turn, t_req, {}, {}, "refusal" if reply == _refusal(language) else "cached", language)
         return jsonify({"reply": reply, "session_id": session_id})
-    except Exception as e:
-        return jsonify({"reply": f"Error contacting Ollama: {e}"}), 500
+    if not ensure_ollama_running():
+        _finish_turn("talk", turn, t_req, {}, {}, "ollama_unreachable", language)
+        return jsonify({"reply":"Ollama could not be started or reached."}), 503
 
-@app.route("/logs", methods=["GET"])
-def list_sessions():
-    items = [p.stem.replace("session_","") for p in sorted(MEM_DIR.glob("session_*.jsonl"))]
-    html = ["<html><body><h2>Björn Sessions</h2><ul>"] + [f'<li><a href="/session/{sid}">{sid}</a></li>' for sid in items] + ["</ul></body></html>"]
-    return Response("".join(html), mimetype="text/html")
+    with _session_turn(session_id):
+        name_for_session = _session_name(session_id, user_name)
+        history = _get_session(session_id)
+        payload = _generate_payload(session_id, history, user_text, language, name_for_session)
+        spec = _take_speculation(session_id, payload)
 
-@app.route("/session/<session_id>", methods=["GET"])
-def view_session(session_id):
+        scan, meta, marks = _Scanner(language), {}, {}
+        try:
+            with _generation_slot(session_id, spec, marks):
+                raw_reply = "".join(_reply_tokens(payload, spec, scan, meta)).strip()
+            reply = _refusal(language) if scan.finish() else _safety_wrap(language, user_text, raw_reply)
+            if reply == raw_reply: _cache_store(cache_key, raw_reply)
+            _record_turn(session_id, history, language, name_for_session, user_text, raw_reply, reply, meta.get("context"))
+            _finish_turn("talk", turn, t_req, marks, meta, "ok" if reply == raw_reply else "refusal", language, spec)
+            return jsonify({"reply": reply, "session_id": session_id})
+        except Busy:
+            _finish_turn("talk", turn, t_req, marks, meta, "busy", language)
+            return jsonify({"reply": _busy(language), "busy": True, "session_id": session_id}), 503
+        except Exception as e:
+            _finish_turn("talk", turn, t_req, marks, meta, "error", language, spec)
+            return jsonify({"reply": f"Error contacting Ollama: {e}"}), 500
+
+@app.route("/talk_stream", methods=["POST"])
+def talk_stream():
+    # NDJSON: one {"sentence": ...} line per finished sentence, then {"done": true, "reply": ...}
+    t_req = time.time()
+    user_text, language, session_id, user_name = _turn_request()
+    if not user_text: return jsonify({"error":"Missing text"}), 400
+    turn = (request.json or {}).get("turn_id")
+
+    def line(obj): return json.dumps(obj, ensure_ascii=False) + "\n"
+
+    cache_key = _reply_cache_key(user_text, language, _session_name(session_id, user_name), (request.json or {}).get("cache", True))
+    reply = _answer_without_ollama(session_id, user_text, language, user_name, cache_key)
+    if reply is not None:
+        _finish_turn("talk_stream", turn, t_req, {}, {}, "refusal" if reply == _refusal(language) else "cached", language)
+        body = "".join(line({"sentence": s}) for s in _sentences(reply))
+        return Response(body + line({"done": True, "reply": reply, "session_id": session_id}), mimetype="application/x-ndjson")
+    if not ensure_ollama_running():
+        _finish_turn("talk_stream", turn, t_req, {}, {}, "ollama_unreachable", language)
+        return jsonify({"reply":"Ollama could not be started or reached."}), 503
+
+    def generate():
+        # The session lock is held for the whole stream and released when the client disconnects.
+        with _session_turn(session_id):
+            name_for_session = _session_name(session_id, user_name)
+            history = _get_session(session_id)
+            payload = _generate_payload(session_id, history, user_text, language, name_for_session)
+            spec = _take_speculation(session_id, payload)
+            raw, buf, scan, meta, marks = [], "", _Scanner(language), {}, {}
+            try:
+                # Sentences already sent cannot be taken back, so a hit stops generation and the
+                # refusal replaces the rest of the reply.
+                with _generation_slot(session_id, spec, marks):
+                    for tok in _reply_tokens(payload, spec, scan, meta):
+                        raw.append(tok)
+                        sentences, buf = _split_sentences(buf + tok)
+                        if sentences: marks.setdefault("first_sentence", time.time())
+                        for s in sentences: yield line({"sentence": s})
+                if not scan.finish() and buf.strip(): yield line({"sentence": buf.strip()})
+                if scan.hit: yield line({"sentence": _refusal(language)})
+            except Busy:
+                _finish_turn("talk_stream", turn, t_req, marks, meta, "busy", language)
+                yield line({"sentence": _busy(language)})
+                yield line({"done": True, "busy": True, "reply": _busy(language), "session_id": session_id}); return
+            except Exception as e:
+                _finish_turn("talk_stream", turn, t_req, marks, meta, "error", language, spec)
+                yield line({"done": True, "error": f"Error contacting Ollama: {e}"}); return
+            raw_reply = "".join(raw).strip()
+            reply = _refusal(language) if scan.hit else raw_reply
+            if reply == raw_reply: _cache_store(cache_key, raw_reply)
+            _record_turn(session_id, history, language, name_for_session, user_text, raw_reply, reply, meta.get("context"))
+            _finish_turn("talk_stream", turn, t_req, marks, meta, "refusal" if scan.hit else "ok", language, spec)
+            yield line({"done": True, "reply": reply, "session_id": session_id})
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@app.route("/prefetch", methods=["POST"])
+def prefetch():
+    # Called with partial transcripts while the button is held. Starts generating for the
+    # partial text; /talk keeps the result if its final payload matches, otherwise cancels it.
+    user_text, language, session_id, user_name = _turn_request()
+    if not SPECULATE or not user_text or _blocked(user_text, language): return jsonify({"ok": False})
+    if not ensure_ollama_running(): return jsonify({"ok": False}), 503
+
+    name_for_session = _session_name(session_id, user_name)
+    history = _get_session(session_id)
+    payload = _generate_payload(session_id, history, user_text, language, name_for_session)
+    with LOCK:
+        # A partial that arrives while the final turn runs, or just after it, belongs to a turn
+        # that is already answered; nothing would ever take its generation.
+        if session_id in SESSION_LOCKS or time.time() - TURN_ENDED.get(session_id, 0) < PREFETCH_QUIET_S:
+            return jsonify({"ok": False})
+        old = SPECULATIONS.get(session_id)
+        if old and old.payload == payload: return jsonify({"ok": True})
+        # A newer partial takes over the previous speculation's slot; otherwise speculation only
+        # runs on a slot that no real turn is waiting for.
+        if not (old and old.hand_over()) and not SCHED.try_acquire():
+            SPECULATIONS.pop(session_id, None)
+            return jsonify({"ok": False, "busy": True})
+        SPECULATIONS[session_id] = _Speculation(payload, language)
+    return jsonify({"ok": True})
+
+@app.route("/warm", methods=["POST"])
+def warm():
+    # Called by the bear at boot so the first turn does not pay for starting Ollama or loading
+    # the model: a generate request without a prompt only loads MODEL into memory.
+    t0 = time.time()
+    if not ensure_ollama_running(): return jsonify({"ok": False, "error": "ollama_unreachable"}), 503
+    t1 = time.time()
+    try:
+        _ollama_post({"model": MODEL}).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        return jsonify({"ok": False, "error": str(e)}), 503
+    return jsonify({"ok": True, "model": MODEL, "ollama_s": round(t1 - t0, 3), "load_s": round(time.time() - t1, 3)})
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    with LOCK: cache = dict(REPLY_CACHE_STATS, size=len(REPLY_CACHE))
+    return jsonify({"ollama_queue": SCHED.stats(), "reply_cache": cache})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # Request-path collectors are the histograms and counters above; everything else is read here,
+    # once per scrape.
+    with LOCK:
+        n_sessions = len(SESSIONS); session_bytes = SESSION_BYTES
+        n_speculations = len(SPECULATIONS)
+        cache = dict(REPLY_CACHE_STATS, size=len(REPLY_CACHE))
+    q = SCHED.stats()
+    body = metrics.render([
+        ("bjoern_sessions", "gauge", "Sessions held in memory.", n_sessions),
+        ("bjoern_session_bytes", "gauge", "Approximate size of the in-memory session histories.", session_bytes),
+        ("bjoern_speculations", "gauge", "Speculative generations from partial transcripts in flight.", n_speculations),
+        ("bjoern_ollama_up", "gauge", "Whether the last Ollama health check succeeded.", int(bool(OLLAMA_HEALTH.alive))),
+        ("bjoern_ollama_slots", "gauge", "Ollama scheduler slots by state.",
+         [({"state": "limit"}, q["limit"]), ({"state": "active"}, q["active"]), ({"state": "queued"}, q["queued"])]),
+        ("bjoern_ollama_admitted_total", "counter", "Requests admitted by the Ollama scheduler.", q["admitted"]),
+        ("bjoern_ollama_rejected_total", "counter", "Requests the Ollama scheduler turned away as busy.", q["rejected"]),
+        ("bjoern_ollama_queue_wait_avg_seconds", "gauge", "Mean wait for an Ollama slot.", q["wait_avg_s"]),
+        ("bjoern_ollama_queue_wait_max_seconds", "gauge", "Longest wait for an Ollama slot.", q["wait_max_s"]),
+        ("bjoern_reply_cache_entries", "gauge", "Entries in the reply cache.", cache["size"]),
+        ("bjoern_reply_cache_hits_total", "counter", "Reply cache hits.", cache["hits"]),
+        ("bjoern_reply_cache_misses_total", "counter", "Reply cache misses.", cache["misses"]),
+    ])
+    return Response(body, content_type=metrics.CONTENT_TYPE)
+
+def _list_session_ids(offset, limit):
+    if DB: return DB.sessions(offset, limit)
+    names = sorted(e.name[len("session_"):-len(".jsonl")] for e in os.scandir(MEM_DIR)
+                   if e.name.startswith("session_") and e.name.endswith(".jsonl"))
+    return names[offset:offset + limit]
+
+def _session_rows(session_id, offset, limit):
+    if DB: return DB.rows(session_id, offset, limit)
     path = MEM_DIR / f"session_{session_id}.jsonl"
     rows = []
     if path.exists():
         with path.open("r", encoding="utf-8") as f:
-            for line in f:
+            for line in islice(f, offset, offset + limit):
                 try: rows.append(json.loads(line.strip()))
                 except Exception: pass
-    html = ['<html><body><a href="/logs">← back</a><h2>Session '
-            f'{session_id}</h2><div style="font-family:system-ui;max-width:800px">']
-    for r in rows:
-        role = r.get("role",""); content = (r.get("content","") or "").replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
-        ts = datetime.utcfromtimestamp(r.get("ts", time.time())).strftime("%Y-%m-%d %H:%M:%S")
-        color = "#eef" if role == "user" else "#efe"
-        html.append(f'<div style="background:{color};padding:10px;margin:8px 0;border-radius:8px"><div style="opacity:.6">{role} · {ts}</div><div>{content}</div></div>')
-    html.append("</div></body></html>")
-    return Response("".join(html), mimetype="text/html")
+    return rows
+
+def _page():
+    try: return max(0, int(request.args.get("page", "0")))
+    except ValueError: return 0
+
+def _pager(base, page, has_next):
+    links = []
+    if page > 0: links.append(f'<a href="{base}?page={page - 1}">← prev</a>')
+    if has_next: links.append(f'<a href="{base}?page={page + 1}">next →</a>')
+    return f'<p>{" · ".join(links)}</p>' if links else ""
+
+@app.route("/logs", methods=["GET"])
+def list_sessions():
+    page = _page()
+    items = _list_session_ids(page * PAGE_SIZE, PAGE_SIZE + 1)
+    has_next = len(items) > PAGE_SIZE
+
+    def generate():
+        yield "<html><body><h2>Björn Sessions</h2><ul>"
+        for sid in items[:PAGE_SIZE]: yield f'<li><a href="/session/{sid}">{sid}</a></li>'
+        yield "</ul>" + _pager("/logs", page, has_next) + "</body></html>"
+    return Response(generate(), mimetype="text/html")
+
+@app.route("/session/<session_id>", methods=["GET"])
+def view_session(session_id):
+    page = _page()
+    rows = _session_rows(session_id, page * PAGE_SIZE, PAGE_SIZE + 1)
+    has_next = len(rows) > PAGE_SIZE
+
+    def generate():
+        yield ('<html><body><a href="/logs">← back</a><h2>Session '
+               f'{session_id}</h2><div style="font-family:system-ui;max-width:800px">')
+        for r in rows[:PAGE_SIZE]:
+            role = r.get("role",""); content = (r.get("content","") or "").replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
+            ts = datetime.utcfromtimestamp(r.get("ts", time.time())).strftime("%Y-%m-%d %H:%M:%S")
+            color = "#eef" if role == "user" else "#efe"
+            yield f'<div style="background:{color};padding:10px;margin:8px 0;border-radius:8px"><div style="opacity:.6">{role} · {ts}</div><div>{content}</div></div>'
+        yield "</div>" + _pager(f"/session/{session_id}", page, has_next) + "</body></html>"
+    return Response(generate(), mimetype="text/html")
+
+def serve():
+    if SERVER == "waitress":
+        try:
+            from waitress import serve as waitress_serve
+            print(f"[LLM] waitress on {HOST}:{PORT} with {THREADS} threads")
+            waitress_serve(app, host=HOST, port=PORT, threads=THREADS, channel_timeout=180)
+            return
+        except ImportError:
+            print("[LLM] waitress not installed, using Flask's threaded server")
+    app.run(host=HOST, port=PORT, threaded=True)
 
 if __name__ == "__main__":
     ensure_ollama_running()
-    app.run(host="0.0.0.0", port=5000)
+    serve()
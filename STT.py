@@ -1,10 +1,203 @@
+import os
+import time
+import wave
 import sounddevice as sd
 import vosk
-import queue
 import sys
 import json
-from queue import Empty
-from typing import Callable, Optional
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional
+
+
+class Vad:
+    # Energy + zero-crossing voice activity detector on int16 blocks, evaluated per 20 ms frame.
+    # The threshold follows the background level (noise floor + margin_db, never below
+    # threshold_db). A turn counts as started after min_speech_ms of speech and ends after
+    # hangover_ms of trailing silence. With wake=True it waits for speech indefinitely,
+    # otherwise it gives up after start_timeout_s without speech.
+    def __init__(
+        self,
+        samplerate: int = 16000,
+        frame_ms: int = 20,
+        threshold_db: float = -45.0,
+        margin_db: float = 10.0,
+        zcr_max: float = 0.4,
+        min_speech_ms: int = 200,
+        hangover_ms: int = 600,
+        start_timeout_s: float = 6.0,
+        max_utterance_s: float = 20.0,
+        wake: bool = False,
+        use_vosk_endpoint: bool = True,
+    ):
+        self.frame = max(1, samplerate * frame_ms // 1000)
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.zcr_max = zcr_max
+        self.min_speech_ms = min_speech_ms
+        self.hangover_ms = hangover_ms
+        self.start_timeout_ms = start_timeout_s * 1000.0
+        self.max_utterance_ms = max_utterance_s * 1000.0
+        self.wake = wake
+        self.use_vosk_endpoint = use_vosk_endpoint
+        self.reset()
+
+    def reset(self):
+        self.noise_db = self.threshold_db - self.margin_db
+        self.triggered = False
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self.waited_ms = 0
+        self.voiced_ms = 0
+
+    def speech_frames(self, block: bytes):
+        import numpy as np  # deferred: only the VAD path needs it
+        x = np.frombuffer(block, dtype=np.int16)
+        n = x.size // self.frame
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        f = x[: n * self.frame].reshape(n, self.frame).astype(np.float32)
+        db = 10.0 * np.log10(np.mean(f * f, axis=1) / (32768.0 * 32768.0) + 1e-10)
+        zcr = np.mean(np.signbit(f[:, 1:]) != np.signbit(f[:, :-1]), axis=1)
+        speech = (db > max(self.threshold_db, self.noise_db + self.margin_db)) & (zcr < self.zcr_max)
+        quiet = db[~speech]
+        if quiet.size:
+            self.noise_db = 0.95 * self.noise_db + 0.05 * float(np.mean(quiet))
+        return speech
+
+    def update(self, block: bytes) -> str:
+        # Returns "wait" (no speech yet), "speech", "end" or "timeout".
+        for is_speech in self.speech_frames(block):
+            if is_speech:
+                self.speech_ms += self.frame_ms
+                self.silence_ms = 0
+                if self.speech_ms >= self.min_speech_ms:
+                    self.triggered = True
+            else:
+                self.silence_ms += self.frame_ms
+                if not self.triggered:
+                    self.speech_ms = 0
+            if self.triggered:
+                self.voiced_ms += self.frame_ms
+                if self.silence_ms >= self.hangover_ms or self.voiced_ms >= self.max_utterance_ms:
+                    return "end"
+            else:
+                self.waited_ms += self.frame_ms
+                if not self.wake and self.waited_ms >= self.start_timeout_ms:
+                    return "timeout"
+        return "speech" if self.triggered else "wait"
+
+
+class _CaptureRing:
+    # Preallocated byte ring for int16 capture. The audio callback copies each block in with a
+    # slice assignment (no per-block allocation) and sets `ready`; the recording loop drains it.
+    # One writer (the callback) and one reader, each moving only its own index.
+    def __init__(self, nbytes: int):
+        self.buf = bytearray(nbytes)
+        self.mv = memoryview(self.buf)
+        self.cap = nbytes
+        self.r = 0
+        self.w = 0
+        self.dropped = 0
+        self.ready = threading.Event()
+
+    def __len__(self) -> int:
+        return self.w - self.r
+
+    def write(self, data):
+        src = memoryview(data).cast("B")
+        n = len(src)
+        if n > self.cap - (self.w - self.r):
+            self.dropped += n
+        else:
+            i = self.w % self.cap
+            k = min(n, self.cap - i)
+            self.mv[i:i + k] = src[:k]
+            self.mv[:n - k] = src[k:]
+            self.w += n
+        self.ready.set()
+
+    def read(self, max_bytes: int) -> bytes:
+        n = min(self.w - self.r, max_bytes) & ~1
+        if n <= 0:
+            return b""
+        i = self.r % self.cap
+        k = min(n, self.cap - i)
+        out = bytes(self.mv[i:i + k]) if k == n else bytes(self.mv[i:i + k]) + bytes(self.mv[:n - k])
+        self.r += n
+        return out
+
+
+class _Decoder:
+    # One KaldiRecognizer and the transcript it has produced so far. With words=True it also
+    # keeps Vosk's per-word confidences, which dual-language mode compares.
+    def __init__(self, lang: str, model: vosk.Model, samplerate: int, words: bool = False):
+        self.lang = lang
+        self.rec = vosk.KaldiRecognizer(model, samplerate)
+        if words:
+            self.rec.SetWords(True)
+        self.segments: list[str] = []
+        self.confs: list[float] = []
+        self.last_partial = ""
+
+    def _take(self, result: str):
+        j = json.loads(result)
+        if j.get("text"):
+            self.segments.append(j["text"])
+        self.confs += [w.get("conf", 0.0) for w in j.get("result", [])]
+
+    def accept(self, data: bytes) -> bool:
+        if self.rec.AcceptWaveform(data):
+            self._take(self.rec.Result())
+            return True
+        return False
+
+    def text(self, partial: str = "") -> str:
+        return " ".join(t for t in self.segments + [partial] if t).strip()
+
+    def progress(self, endpoint: bool, on_partial: Optional[Callable[[str], None]]):
+        if on_partial is None:
+            return
+        text = self.text("" if endpoint else json.loads(self.rec.PartialResult()).get("partial", ""))
+        if text and text != self.last_partial:
+            self.last_partial = text
+            on_partial(text)
+
+    def finish(self) -> str:
+        self._take(self.rec.FinalResult())
+        return self.text()
+
+    def score(self) -> float:
+        return sum(self.confs) / len(self.confs) if self.confs else 0.0
+
+
+class _DecodeWorker:
+    # Runs a _Decoder in its own thread. Vosk releases the GIL while decoding, so the English
+    # and German recognizers really do run side by side on the Pi's cores.
+    def __init__(self, decoder: _Decoder, on_partial=None):
+        self.decoder = decoder
+        self.on_partial = on_partial
+        self.q: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            data = self.q.get()
+            if data is None:
+                self.decoder.finish()
+                return
+            self.decoder.progress(self.decoder.accept(data), self.on_partial)
+
+    def feed(self, data: bytes):
+        self.q.put(data)
+
+    def finish(self):
+        self.q.put(None)
+        self.thread.join()
 
 
 class SpeechToText:
@@ -13,20 +206,27 @@ class SpeechToText:
         model_path_en: str = "sst_models/vosk-model-english",
         model_path_de: str = "sst_models/vosk-model-german",
         samplerate: int = 16000,
-        blocksize: int = 8000,
+        blocksize: int = 800,
         language: str = "en",
         device: Optional[int | str] = None,
         debug: bool = False,
+        preload: bool = False,
+        language_bias: float = 0.05,
     ):
         self.samplerate = samplerate
         self.blocksize = blocksize
         self.device = device
         self.debug = debug
+        self.language_bias = language_bias  # confidence edge the current language gets in transcribe_detect()
 
         self._model_paths = {"en": model_path_en, "de": model_path_de}
         self._models: dict[str, vosk.Model] = {}
+        self._loading: dict[str, threading.Thread] = {}
+        self._load_lock = threading.Lock()
         self._lang = "en"
         self._model: Optional[vosk.Model] = None
+        if preload:
+            self.preload()
         self.set_language(language)
 
         if self.debug:
@@ -40,7 +240,27 @@ class SpeechToText:
             except Exception as e:
                 print("[STT] Could not query device info:", e)
 
+    def preload(self, langs=("en", "de")):
+        # Loads the models in background threads so switching language later does not block;
+        # _ensure_loaded() waits for a model that is still loading.
+        with self._load_lock:
+            for lang in langs:
+                if lang in self._models or lang in self._loading or not self._model_paths.get(lang):
+                    continue
+                t = self._loading[lang] = threading.Thread(target=self._load, args=(lang,), daemon=True)
+                t.start()
+
+    def _load(self, lang: str):
+        try:
+            self._models[lang] = vosk.Model(self._model_paths[lang])
+        except Exception as e:
+            print(f"[STT] Could not preload '{lang}' model:", e, file=sys.stderr)
+
     def _ensure_loaded(self, lang: str) -> vosk.Model:
+        with self._load_lock:
+            t = self._loading.get(lang)
+        if t is not None:
+            t.join()
         if lang not in self._models:
             path = self._model_paths.get(lang)
             if not path:
@@ -59,53 +279,224 @@ class SpeechToText:
     def language(self) -> str:
         return self._lang
 
-    def transcribe_until(self, stop_fn: Callable[[], bool]) -> str:
+    def transcribe_until(
+        self,
+        stop_fn: Callable[[], bool],
+        on_partial: Optional[Callable[[str], None]] = None,
+        vad: Optional[Vad] = None,
+    ) -> str:
+        # Records until stop_fn() is true. With a Vad the turn also ends on its own once speech
+        # was followed by trailing silence (or Vosk reported an endpoint during that silence);
+        # while the Vad is still waiting for speech, audio is only kept as a short pre-roll.
+        return self._transcribe(stop_fn, on_partial, vad, detect=False)[0]
+
+    def transcribe_detect(
+        self,
+        stop_fn: Callable[[], bool],
+        on_partial: Optional[Callable[[str], None]] = None,
+        vad: Optional[Vad] = None,
+    ) -> tuple[str, str]:
+        # Like transcribe_until(), but decodes with the English and German models in parallel and
+        # returns (text, language) for the one with the higher mean word confidence. Partials come
+        # from the current language. Vosk endpoints are ignored here; a Vad still ends the turn.
+        return self._transcribe(stop_fn, on_partial, vad, detect=True)
+
+    def _pick(self, decoders: list[_Decoder]) -> _Decoder:
+        def rank(d: _Decoder):
+            return (bool(d.segments), d.score() + (self.language_bias if d.lang == self._lang else 0.0))
+        best = max(decoders, key=rank)
+        if self.debug:
+            print("[STT] language scores:", {d.lang: round(d.score(), 3) for d in decoders}, "->", best.lang)
+        return best
+
+    def transcribe_stream(self, blocks: Iterable[bytes], samplerate: Optional[int] = None, lang: Optional[str] = None) -> str:
+        # Decodes int16 mono PCM from any iterable of byte blocks instead of the microphone.
+        lang = lang or self._lang
+        dec = _Decoder(lang, self._ensure_loaded(lang), samplerate or self.samplerate)
+        for block in blocks:
+            if block:
+                dec.accept(block)
+        return dec.finish()
+
+    def transcribe_file(self, path: str, lang: Optional[str] = None) -> str:
+        rate, blocks = pcm_blocks(path, self.blocksize, self.samplerate)
+        return self.transcribe_stream(blocks, rate, lang)
+
+    def _transcribe(self, stop_fn, on_partial, vad, detect: bool) -> tuple[str, str]:
         if self._model is None:
             raise RuntimeError("Vosk model not loaded")
 
-        q: queue.Queue[bytes] = queue.Queue()
+        ring = _CaptureRing(self.samplerate * 2 * 10)  # 10 s of int16 mono
 
         def callback(indata, frames, time_info, status):
             if status:
                 print(status, file=sys.stderr)
-            q.put(bytes(indata))
+            ring.write(indata)
             if self.debug:
                 import numpy as np
                 level = 20 * np.log10(np.max(np.abs(np.frombuffer(indata, dtype="int16"))) / 32768 + 1e-9)
                 print(f"[STT] level ~ {level:.1f} dBFS")
 
-        rec = vosk.KaldiRecognizer(self._model, self.samplerate)
+        primary = _Decoder(self._lang, self._model, self.samplerate, words=detect)
+        decoders = [primary]
+        workers: list[_DecodeWorker] = []
+        if detect:
+            for lang in self._model_paths:
+                if lang != self._lang:
+                    decoders.append(_Decoder(lang, self._ensure_loaded(lang), self.samplerate, words=True))
+            workers = [_DecodeWorker(d, on_partial if d is primary else None) for d in decoders]
+
+        def decode(data: bytes) -> bool:
+            if workers:
+                for w in workers:
+                    w.feed(data)
+                return False
+            endpoint = primary.accept(data)
+            if not (endpoint and vad is not None and vad.use_vosk_endpoint and vad.silence_ms >= vad.hangover_ms // 3):
+                primary.progress(endpoint, on_partial)
+                return False
+            return True
+
+        blocksize = self.blocksize
+        # Whatever has queued up is decoded in one AcceptWaveform call, up to max_batch: small
+        # batches while the recognizer keeps up, larger ones when it falls behind.
+        max_batch = self.samplerate * 2 // 2
+        preroll: deque[bytes] = deque()
+        preroll_max = self.samplerate * 2 * 4 // 10  # 400 ms kept before speech onset
+        if vad is not None:
+            vad.reset()
+            blocksize = min(blocksize, self.samplerate // 10)  # 100 ms blocks for a prompt endpoint
 
         try:
             with sd.RawInputStream(
                 samplerate=self.samplerate,
-                blocksize=self.blocksize,
+                blocksize=blocksize,
                 dtype="int16",
                 channels=1,
                 device=self.device,
                 callback=callback,
             ):
-                while not stop_fn():
-                    try:
-                        data = q.get(timeout=0.2)
-                    except Empty:
+                stopped = False
+                while not stopped:
+                    # After stop_fn() only what is already in the ring (the last block or
+                    # so) is decoded before FinalResult().
+                    stopped = stop_fn()
+                    ring.ready.clear()
+                    data = ring.read(max_batch)
+                    if not data:
+                        if not stopped:
+                            ring.ready.wait(0.02)
+                        continue
+                    if stopped:
+                        data += ring.read(len(ring))
+                    state = vad.update(data) if vad is not None else "speech"
+                    # Once the button is released a word too short to trigger the VAD (still
+                    # "wait") is decoded from the preroll anyway instead of being dropped.
+                    if state == "timeout" and not stopped:
+                        break
+                    if state == "wait" and not stopped:
+                        preroll.append(data)
+                        while sum(map(len, preroll)) > preroll_max:
+                            preroll.popleft()
                         continue
-                    rec.AcceptWaveform(data)
+                    while preroll:
+                        decode(preroll.popleft())
+                    if state == "end":
+                        break
+                    if decode(data):
+                        break
 
-                final = json.loads(rec.FinalResult()).get("text", "")
-                return (final or "").strip()
+                if ring.dropped and self.debug:
+                    print(f"[STT] capture overrun, dropped {ring.dropped} bytes", file=sys.stderr)
         except Exception as e:
             print("[STT] Audio error:", e, file=sys.stderr)
-            return ""
+            for w in workers:
+                w.finish()
+            return "", self._lang
+        if not workers:
+            return primary.finish(), self._lang
+        for w in workers:
+            w.finish()
+        best = self._pick(decoders)
+        return best.text(), best.lang
+
+
+# -------------------- Files and batches --------------------
+
+def pcm_blocks(path: str, blocksize: int = 4000, samplerate: int = 16000) -> tuple[int, Iterator[bytes]]:
+    # (sample_rate, blocks) for a mono 16-bit WAV file, or for headerless int16 PCM at samplerate.
+    if path.lower().endswith(".wav"):
+        w = wave.open(path, "rb")
+        if w.getnchannels() != 1 or w.getsampwidth() != 2:
+            w.close()
+            raise ValueError(f"{path}: expected mono 16-bit PCM")
+        def frames():
+            with w:
+                while True:
+                    data = w.readframes(blocksize)
+                    if not data:
+                        return
+                    yield data
+        return w.getframerate(), frames()
+    def raw():
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(blocksize * 2)
+                if not data:
+                    return
+                yield data
+    return samplerate, raw()
+
+_pool_model: Optional[vosk.Model] = None
+_pool_opts: dict = {}
+
+def _pool_init(model_path: str, samplerate: int, blocksize: int):
+    # Runs once per worker process: each worker loads its own model and reuses it for every file.
+    global _pool_model
+    vosk.SetLogLevel(-1)
+    _pool_model = vosk.Model(model_path)
+    _pool_opts.update(samplerate=samplerate, blocksize=blocksize)
+
+def _pool_job(path: str) -> dict:
+    t0 = time.perf_counter()
+    rate, blocks = pcm_blocks(path, _pool_opts["blocksize"], _pool_opts["samplerate"])
+    dec = _Decoder("", _pool_model, rate)
+    nbytes = 0
+    for block in blocks:
+        nbytes += len(block)
+        dec.accept(block)
+    text = dec.finish()
+    return {"path": path, "text": text, "audio_s": nbytes / (2.0 * rate), "decode_s": time.perf_counter() - t0}
+
+def transcribe_files(
+    paths: Iterable[str],
+    model_path: str,
+    samplerate: int = 16000,
+    blocksize: int = 4000,
+    workers: Optional[int] = None,
+) -> list[dict]:
+    # Batch transcription over a process pool. Returns one dict per file, in input order, with
+    # "text", "audio_s" (audio duration) and "decode_s" (time spent decoding it).
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1,
+        initializer=_pool_init,
+        initargs=(model_path, samplerate, blocksize),
+    ) as ex:
+        return list(ex.map(_pool_job, list(paths)))
 
 
 # -------------------- CLI Test --------------------
 
 if __name__ == "__main__":
-    import time
     print("Initializing STT...")
     stt = SpeechToText(debug=True)
-    print("Speak for 3 seconds...")
-    t0 = time.time()
-    text = stt.transcribe_until(lambda: time.time() - t0 > 3.0)
-    print("Result:", repr(text))
+    if "--vad" in sys.argv:
+        print("Speak; the turn ends when you pause...")
+        t0 = time.time()
+        text = stt.transcribe_until(lambda: False, vad=Vad(wake=True))
+        print(f"Result ({time.time() - t0:.1f}s):", repr(text))
+    else:
+        print("Speak for 3 seconds...")
+        t0 = time.time()
+        text = stt.transcribe_until(lambda: time.time() - t0 > 3.0)
+        print("Result:", repr(text))
@@ -1,9 +1,10 @@
 import os
 import json
 import socket
+import threading
 import subprocess
 import shutil
-import tempfile
+import time
 import re
 from functools import lru_cache
 from typing import Optional
@@ -37,10 +38,13 @@ APLAY_BIN = os.environ.get("APLAY_BIN", "aplay")
 
 DAEMON_HOST = os.environ.get("TTS_DAEMON_HOST", "127.0.0.1")
 DAEMON_PORT = int(os.environ.get("TTS_DAEMON_PORT", "50051"))
+DAEMON_SOCK = os.environ.get("TTS_DAEMON_SOCK", "" if IS_WINDOWS else "/tmp/bjoern-tts.sock")
 TTS_FORCE_DAEMON = os.environ.get("TTS_FORCE_DAEMON", "0") == "1"
+_DAEMON_IS_LOCAL = DAEMON_HOST in ("localhost", "::1") or DAEMON_HOST.startswith("127.")  # only then is DAEMON_SOCK the same daemon
 TTS_DEBUG = os.environ.get("TTS_DEBUG", "0") == "1"
 
 OMP_THREADS = os.environ.get("OMP_NUM_THREADS", "2")
+LOCAL_IDLE_S = float(os.environ.get("TTS_IDLE_MS", "150")) / 1000.0
 
 def _sanitize_text(text: str) -> str:
     if not text:
@@ -55,24 +59,182 @@ def _sanitize_text(text: str) -> str:
     return text.strip()
 
 
-def _daemon_speak(text: str, language: str, timeout: float = 20.0) -> bool:
-    try:
-        with socket.create_connection((DAEMON_HOST, DAEMON_PORT), timeout=2.0) as s:
-            payload = json.dumps({"text": text, "language": language}).encode() + b"\n"
-            s.sendall(payload)
-            s.settimeout(timeout)
-            data = b""
-            while b"\n" not in data:
+class _DaemonClient:
+    # One long-lived connection to the TTS daemon (Unix socket for a local daemon, TCP otherwise).
+    # Requests are tagged with an id and may be pipelined; a reader thread matches replies to
+    # waiters. Messages carrying an "event" key are playback events for an earlier request and
+    # go to that request's listener instead. A dropped connection is reopened on the next request.
+    def __init__(self):
+        self._sock = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._listeners = {}
+        self._next_id = 0
+
+    def _connect(self) -> socket.socket:
+        s = self._connect_unix() if _DAEMON_IS_LOCAL else None
+        if s is None:
+            s = socket.create_connection((DAEMON_HOST, DAEMON_PORT), timeout=2.0)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.settimeout(None)
+        threading.Thread(target=self._reader, args=(s,), daemon=True).start()
+        return s
+
+    def _connect_unix(self):
+        # The socket file outlives a daemon that crashed or was killed, so a failed connect
+        # falls back to TCP instead of failing the request.
+        if not (DAEMON_SOCK and hasattr(socket, "AF_UNIX") and os.path.exists(DAEMON_SOCK)):
+            return None
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(2.0)
+        try:
+            s.connect(DAEMON_SOCK)
+            return s
+        except OSError:
+            s.close()
+            return None
+
+    def _reader(self, s: socket.socket):
+        buf = b""
+        try:
+            while True:
                 chunk = s.recv(4096)
                 if not chunk:
                     break
-                data += chunk
-        if not data:
-            return False
-        resp = json.loads(data.decode().strip() or "{}")
-        return bool(resp.get("ok"))
-    except Exception:
-        return False
+                buf += chunk
+                while b"\n" in buf:
+                    line, buf = buf.split(b"\n", 1)
+                    try:
+                        msg = json.loads(line.decode("utf-8", "ignore") or "{}")
+                    except ValueError:
+                        continue
+                    rid = msg.get("id")
+                    if "event" in msg:
+                        with self._lock:
+                            listener = self._listeners.get(rid)
+                            if msg["event"] == "finished":
+                                self._listeners.pop(rid, None)
+                        if listener:
+                            listener[1](msg)
+                        continue
+                    with self._lock:
+                        waiter = self._pending.pop(rid, None)
+                    if waiter:
+                        waiter[1].update(msg); waiter[2].set()
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                if self._sock is s:
+                    self._sock = None
+                dead = [rid for rid, w in self._pending.items() if w[0] is s]
+                for rid in dead:
+                    self._pending.pop(rid)[2].set()
+                lost = [self._listeners.pop(rid)[1] for rid, l in list(self._listeners.items()) if l[0] is s]
+            for listener in lost:
+                listener({"event": "finished", "error": "disconnected"})
+            try: s.close()
+            except OSError: pass
+
+    def request(self, msg: dict, timeout: float, on_event=None) -> Optional[dict]:
+        reply, done = {}, threading.Event()
+        with self._lock:
+            self._next_id += 1
+            rid = self._next_id
+            data = (json.dumps(dict(msg, id=rid)) + "\n").encode("utf-8")
+            # Only a failed send is retried: the daemon cannot have seen it, so nothing is spoken twice.
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        self._sock = self._connect()
+                    self._pending[rid] = (self._sock, reply, done)
+                    if on_event:
+                        self._listeners[rid] = (self._sock, on_event)
+                    self._sock.sendall(data)
+                    break
+                except OSError:
+                    self._pending.pop(rid, None)
+                    self._listeners.pop(rid, None)
+                    if self._sock is not None:
+                        try: self._sock.close()
+                        except OSError: pass
+                    self._sock = None
+                    if attempt:
+                        return None
+        if not done.wait(timeout):
+            with self._lock:
+                self._pending.pop(rid, None)
+                self._listeners.pop(rid, None)
+            return None
+        if not (reply and reply.get("ok")):
+            with self._lock:
+                self._listeners.pop(rid, None)
+        return reply or None
+
+_client = _DaemonClient()
+
+
+class Playback:
+    # Handle for one utterance sent to the daemon. started_ts/finished_ts are the daemon's
+    # estimates of when the audio becomes audible and when it has fully played out.
+    def __init__(self):
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.started_ts = None
+        self.finished_ts = None
+        self.cancelled = False
+
+    def _on_event(self, msg: dict):
+        if msg.get("event") == "started":
+            self.started_ts = msg.get("ts")
+            self.started.set()
+        elif msg.get("event") == "finished":
+            self.finished_ts = msg.get("ts")
+            self.cancelled = bool(msg.get("cancelled"))
+            with _playing_cv:
+                _playing.discard(self)
+                _playing_cv.notify_all()
+            self.started.set()
+            self.finished.set()
+
+_playing = set()
+_playing_cv = threading.Condition()
+
+
+def _daemon_speak(text: str, language: str, timeout: float = 20.0, turn: Optional[str] = None) -> Optional[Playback]:
+    pb = Playback()
+    with _playing_cv:
+        _playing.add(pb)
+    msg = {"text": text, "language": language}
+    if turn:
+        msg["turn"] = turn
+    resp = _client.request(msg, timeout, on_event=pb._on_event)
+    if resp and resp.get("ok"):
+        return pb
+    with _playing_cv:
+        _playing.discard(pb)
+        _playing_cv.notify_all()
+    return None
+
+
+def is_speaking() -> bool:
+    with _playing_cv:
+        return bool(_playing)
+
+def wait_until_done(timeout: Optional[float] = None) -> bool:
+    # Blocks until everything queued on the daemon has been played (or cancelled).
+    with _playing_cv:
+        return _playing_cv.wait_for(lambda: not _playing, timeout)
+
+def warm(languages=("en", "de"), timeout: float = 30.0) -> bool:
+    # Asks the daemon to start these voices and open its audio output ahead of the first speak().
+    resp = _client.request({"op": "warm", "languages": list(languages)}, timeout)
+    return bool(resp and resp.get("ok"))
+
+def cancel() -> bool:
+    # Barge-in: stops the current utterance, drops queued ones and flushes the audio buffers.
+    resp = _client.request({"op": "cancel"}, 2.0)
+    return bool(resp and resp.get("ok"))
 
 
 def _have(cmd: str) -> bool:
@@ -95,7 +257,132 @@ def _piper_flag_style() -> str:
         pass
     return "short"
 
-def speak(text: str, language: str = "en") -> bool:
+def _read_sample_rate(voice: str) -> int:
+    try:
+        with open(voice + ".json", "r", encoding="utf-8") as f:
+            j = json.load(f)
+        return int((j.get("audio") or {}).get("sample_rate") or j.get("sample_rate", 22050))
+    except Exception:
+        return 22050
+
+class _LocalPiper:
+    # Fallback used when the daemon is down: one Piper process per voice, kept across calls, with
+    # its --output_raw stream written straight into a player so playback starts on the first chunk.
+    # Piper does not mark the end of an utterance, so it is taken as done once output has been
+    # quiet for LOCAL_IDLE_S and the audio written so far has had time to play.
+    def __init__(self, voice: str):
+        self.voice = voice
+        self.sample_rate = _read_sample_rate(voice)
+        self.proc = None
+        self.player = None
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.received = 0
+        self.last_data = 0.0
+        self.play_until = 0.0
+        self.errors = []
+
+    def _cmd(self):
+        cfg = self.voice + ".json"
+        if _piper_flag_style() == "short":
+            cmd = [PIPER_BIN, "-m", self.voice]
+            if os.path.exists(cfg):
+                cmd += ["-c", cfg]
+        else:
+            cmd = [PIPER_BIN, "--model", self.voice]
+            if os.path.exists(cfg):
+                cmd += ["--config", cfg]
+        cmd += ["--output_raw"]
+        if IS_WINDOWS:
+            cmd += ["--json-input"]
+            if ESPEAK_DATA:
+                cmd += ["--espeak_data", ESPEAK_DATA]
+        return cmd
+
+    def _start(self):
+        env = dict(os.environ)
+        for k in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+            env[k] = OMP_THREADS
+        cmd = self._cmd()
+        self.errors = []
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        threading.Thread(target=self._relay, args=(self.proc,), daemon=True).start()
+        threading.Thread(target=self._drain, args=(self.proc,), daemon=True).start()
+        if TTS_DEBUG:
+            print("[TTS] local piper:", " ".join(cmd))
+
+    def _drain(self, proc):
+        for line in iter(proc.stderr.readline, b""):
+            self.errors = (self.errors + [line.decode("utf-8", "ignore").rstrip()])[-5:]
+
+    def _output(self):
+        if IS_WINDOWS:
+            if self.player is None:
+                import sounddevice as sd
+                self.player = sd.RawOutputStream(samplerate=self.sample_rate, channels=1, dtype="int16")
+                self.player.start()
+            return self.player
+        if self.player is None or self.player.poll() is not None:
+            self.player = subprocess.Popen(
+                [APLAY_BIN, "-q", "-f", "S16_LE", "-r", str(self.sample_rate), "-c", "1"],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self.player
+
+    def _relay(self, proc):
+        while True:
+            chunk = proc.stdout.read1(4096)
+            if not chunk:
+                break
+            try:
+                out = self._output()
+                if IS_WINDOWS:
+                    out.write(chunk)
+                else:
+                    out.stdin.write(chunk); out.stdin.flush()
+            except Exception as e:
+                print("[TTS] audio output failed:", e)
+            with self.cond:
+                now = time.time()
+                self.play_until = max(now, self.play_until) + len(chunk) / (2.0 * self.sample_rate)
+                self.received += len(chunk)
+                self.last_data = now
+                self.cond.notify_all()
+        with self.cond:
+            self.cond.notify_all()
+
+    def say(self, text: str, timeout: float = 40.0) -> bool:
+        with self.lock:
+            if self.proc is None or self.proc.poll() is not None:
+                self._start()
+            with self.cond:
+                start = self.received
+            line = json.dumps({"text": text}) + "\n" if IS_WINDOWS else text + "\n"
+            try:
+                self.proc.stdin.write(line.encode("utf-8")); self.proc.stdin.flush()
+            except OSError:
+                pass
+            deadline = time.time() + timeout
+            with self.cond:
+                while True:
+                    now = time.time()
+                    if self.received > start and now - self.last_data >= LOCAL_IDLE_S:
+                        break
+                    if now > deadline or self.proc.poll() is not None:
+                        break
+                    self.cond.wait(LOCAL_IDLE_S / 2)
+                got, remaining = self.received > start, self.play_until - time.time()
+            if not got:
+                print("[TTS] Piper failed:", " | ".join(self.errors) or "(no audio)")
+                print("[TTS] Tried:", " ".join(self._cmd()))
+                return False
+            if remaining > 0:
+                time.sleep(remaining)
+            return True
+
+_local = {}
+_local_lock = threading.Lock()
+
+def speak(text: str, language: str = "en", wait: bool = False, turn: Optional[str] = None) -> bool:
     text = (text or "").strip()
     if not text:
         return True
@@ -103,13 +390,15 @@ def speak(text: str, language: str = "en") -> bool:
     clean_text = _sanitize_text(text)
 
     # Try daemon first
-    used_daemon = _daemon_speak(clean_text, language)
+    pb = _daemon_speak(clean_text, language, turn=turn)
     if TTS_DEBUG:
-        print(f"[TTS] daemon={used_daemon} host={DAEMON_HOST} port={DAEMON_PORT}")
-    if TTS_FORCE_DAEMON and not used_daemon:
+        print(f"[TTS] daemon={pb is not None} host={DAEMON_HOST} port={DAEMON_PORT}")
+    if TTS_FORCE_DAEMON and pb is None:
         print("[TTS] Daemon required but unavailable.")
         return False
-    if used_daemon:
+    if pb is not None:
+        if wait:
+            pb.finished.wait()
         return True
 
     # Fallback if daemon not available
@@ -125,82 +414,15 @@ def speak(text: str, language: str = "en") -> bool:
         print(f"[TTS] Voice model not found: {voice}")
         return False
 
-    cfg = voice + ".json"
-    use_cfg = os.path.exists(cfg)
-
     try:
-        with tempfile.NamedTemporaryFile(prefix="tts_", suffix=".wav", delete=False) as tmp:
-            wav_path = tmp.name
-
-        style = _piper_flag_style()
-        tried_cmds = []
-
-        env = dict(os.environ)
-        for k in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
-            env[k] = OMP_THREADS
-
-        def run_piper(cmd):
-            tried_cmds.append(" ".join(cmd))
-            return subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-                env=env,
-            )
-
-        if style == "short":
-            cmd = [PIPER_BIN, "-m", voice, "-f", wav_path]
-            if use_cfg:
-                cmd += ["-c", cfg]
-        else:
-            cmd = [PIPER_BIN, "--model", voice, "--output_file", wav_path]
-            if use_cfg:
-                cmd += ["--config", cfg]
-
-        if IS_WINDOWS:
-            cmd += ["--json-input"]
-            if ESPEAK_DATA:
-                cmd += ["--espeak_data", ESPEAK_DATA]
-
-        proc = run_piper(cmd)
-        assert proc.stdin is not None
-
-        if IS_WINDOWS:
-            payload = json.dumps({"text": clean_text}) + "\n"
-            proc.stdin.write(payload.encode("utf-8"))
-        else:
-            proc.stdin.write(clean_text.encode("utf-8"))
-
-        proc.stdin.close()
-        proc.wait(timeout=40)
-
-        if proc.returncode != 0:
-            err = proc.stderr.read().decode("utf-8", errors="ignore")
-            print("[TTS] Piper failed:", err.strip() or "(no error text)")
-            print("[TTS] Tried:", " | ".join(tried_cmds))
-            return False
-
-        if IS_WINDOWS:
-            import winsound
-            winsound.PlaySound(wav_path, winsound.SND_FILENAME)
-        else:
-            ap = subprocess.run([APLAY_BIN, "-q", wav_path], capture_output=True)
-            if ap.returncode != 0:
-                print("[TTS] aplay failed:", ap.stderr.decode("utf-8", errors="ignore").strip())
-                return False
-
-        return True
-
+        with _local_lock:
+            local = _local.get(voice)
+            if local is None:
+                local = _local[voice] = _LocalPiper(voice)
+        return local.say(clean_text)
     except Exception as e:
         print("[TTS] Error:", e)
         return False
-    finally:
-        try:
-            if "wav_path" in locals() and os.path.exists(wav_path):
-                os.remove(wav_path)
-        except Exception:
-            pass
 
 
 # -------------------- CLI Test --------------------
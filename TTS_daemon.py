@@ -1,9 +1,12 @@
-import os, json, socket, threading, subprocess, time, sys, signal, shutil
+import os, json, socket, threading, subprocess, time, sys, signal, shutil, hashlib, queue, re
+import turn_trace
+from functools import lru_cache
 
 IS_WINDOWS = (os.name == "nt")
 
 HOST = os.environ.get("TTS_DAEMON_HOST", "127.0.0.1")
 PORT = int(os.environ.get("TTS_DAEMON_PORT", "50051"))
+SOCK_PATH = os.environ.get("TTS_DAEMON_SOCK", "" if IS_WINDOWS else "/tmp/bjoern-tts.sock")  # "" = TCP only
 
 _default_piper_win = r"C:\piper\piper.exe"
 _default_espeak_win = r"C:\piper\espeak-ng-data"
@@ -18,9 +21,25 @@ APLAY_BIN   = os.environ.get("APLAY_BIN", "aplay")
 ALSA_DEVICE = os.environ.get("ALSA_DEVICE", "default")
 OMP_THREADS = os.environ.get("OMP_NUM_THREADS", "2")
 
+OUTPUT_RATE = int(os.environ.get("TTS_OUTPUT_RATE", "22050"))  # in-process sink rate; voices are resampled to it
+TARGET_DBFS = float(os.environ.get("TTS_TARGET_DBFS", "-20"))  # per-sentence loudness for the in-process sink
 USE_SOX_FADE = (os.environ.get("USE_SOX_FADE", "0") == "1") and not IS_WINDOWS
 FADE_MS = float(os.environ.get("FADE_MS", "12")) / 1000.0
-PRESTART_LANG = os.environ.get("PRESTART_LANG", "") 
+# "sounddevice", "null", "wav:<path>" or "aplay" (player process). Setups that configure the player
+# through ALSA_DEVICE or USE_SOX_FADE keep it unless they choose a sink explicitly.
+TTS_SINK = os.environ.get("TTS_SINK") or ("aplay" if not IS_WINDOWS and ("ALSA_DEVICE" in os.environ or USE_SOX_FADE)
+                                          else "sounddevice")
+PRESTART_LANG = os.environ.get("PRESTART_LANG", "")  # "en", "en,de" or "all"
+SUPERVISE_S = float(os.environ.get("TTS_SUPERVISE_S", "1.0"))
+LOOKAHEAD = int(os.environ.get("TTS_LOOKAHEAD", "2"))  # sentences rendered ahead of playback
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "piper").lower()  # "piper" (process) or "onnx" (in-process, see piper_onnx.py)
+IDLE_S = float(os.environ.get("TTS_IDLE_MS", "150")) / 1000.0            # quiet time that ends a Piper burst
+OUTPUT_LATENCY_S = float(os.environ.get("TTS_OUTPUT_LATENCY_MS", "60")) / 1000.0  # player/device buffering
+
+TTS_CACHE_DIR    = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_MB = float(os.environ.get("TTS_CACHE_MAX_MB", "64"))
+TTS_CACHE_AFTER  = int(os.environ.get("TTS_CACHE_AFTER", "3"))   # cache a phrase once it was requested this often
+TTS_CACHE_MAX_CHARS = int(os.environ.get("TTS_CACHE_MAX_CHARS", "200"))
 
 WIN_OUT_NAME   = os.environ.get("TTS_WIN_OUT", "")
 WIN_OUT_INDEX  = os.environ.get("TTS_WIN_OUT_INDEX", "")
@@ -34,13 +53,20 @@ _env = dict(os.environ)
 for k in ("OMP_NUM_THREADS","OPENBLAS_NUM_THREADS","MKL_NUM_THREADS","NUMEXPR_NUM_THREADS"):
     _env[k] = OMP_THREADS
 
-_cur_lang = None
-_piper_proc = None
+_voices = {}    # lang -> _Voice; each keeps its own Piper process warm
+_outputs = {}   # sample_rate -> player process (Linux) or RawOutputStream (Windows); TTS_SINK=aplay only
+_sink = None    # audio_sink output stage shared by all voices
+_sink_failed = False
+_voices_lock = threading.Lock()
+_out_lock = threading.Lock()
+_stopping = threading.Event()
+_cache_counts = {}
+_play_until = {}  # sample_rate -> wall time at which everything written so far has been played
+_utterances = queue.Queue()                              # accepted, not yet being synthesized
+_rendered = queue.Queue(maxsize=max(1, LOOKAHEAD))       # (utterance, chunks, sample_rate); chunks None = end
+_inflight = set()                                        # utterances between synthesis and playback end
+_inflight_lock = threading.Lock()
 
-_sd_stream = None 
-_sd_thread = None 
-_stop_feeder = threading.Event()
-_sample_rate = 22050
 _sd_device_index = None 
 
 def _log(*a): print(*a, flush=True)
@@ -50,7 +76,7 @@ def _read_sample_rate(model_path: str) -> int:
     try:
         with open(cfg, "r", encoding="utf-8") as f:
             j = json.load(f)
-        return int(j.get("sample_rate", 22050))
+        return int((j.get("audio") or {}).get("sample_rate") or j.get("sample_rate", 22050))
     except Exception as e:
         _log("[DAEMON] Could not read sample_rate from", cfg, "->", e)
         return 22050
@@ -121,200 +147,748 @@ def _pick_windows_output_device():
     _log("[DAEMON] No output devices available.")
     return None
 
-def _start_pipeline(lang: str) -> bool:
-    global _piper_proc, _cur_lang, _sample_rate, _sd_stream, _sd_thread, _stop_feeder
-
-    _stop_pipeline()
-
-    model = VOICE_MAP.get(lang)
-    if not model or not os.path.exists(model) or not os.path.exists(model + ".json"):
-        _log(f"[DAEMON] Missing model/config for '{lang}': {model}")
-        return False
-
-    _sample_rate = _read_sample_rate(model)
-
+def _piper_cmd(model: str):
     cmd = [PIPER_BIN, "-m", model, "-c", model + ".json", "--output_raw"]
     if IS_WINDOWS:
         cmd += ["--json-input"]
         if ESPEAK_DATA:
             cmd += ["--espeak_data", ESPEAK_DATA]
+    return cmd
 
-    _log("[DAEMON] exec:", " ".join(cmd) + (" | (player)" if not IS_WINDOWS else ""))
-
-    try:
-        _piper_proc = subprocess.Popen(
-            cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=_env,
-        )
-        threading.Thread(target=_drain_stderr, args=("piper", _piper_proc), daemon=True).start()
-
-        if IS_WINDOWS:
-            import sounddevice as sd
+def _piper_line(text: str) -> bytes:
+    if IS_WINDOWS:
+        return (json.dumps({"text": text.strip()}) + "\n").encode("utf-8")
+    return (text.strip() + "\n").encode("utf-8")
 
-            global _sd_device_index
-            if _sd_device_index is None:
-                _sd_device_index = _pick_windows_output_device()
+def _open_output(sample_rate: int):
+    if IS_WINDOWS:
+        import sounddevice as sd
 
-            _stop_feeder.clear()
+        global _sd_device_index
+        if _sd_device_index is None:
+            _sd_device_index = _pick_windows_output_device()
+        try:
+            stream = sd.RawOutputStream(
+                samplerate=sample_rate,
+                channels=1,
+                dtype="int16",
+                blocksize=2048,
+                device=_sd_device_index,
+                latency="low",
+            )
+            stream.start()
+            return stream
+        except Exception as e:
+            _log("[DAEMON] Failed to open Windows audio stream:", e)
+            return None
+    proc = subprocess.Popen(
+        _player_cmd_linux(sample_rate),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    threading.Thread(target=_drain_stderr, args=("player", proc), daemon=True).start()
+    return proc
+
+def _get_sink():
+    # The in-process output stage. None when TTS_SINK=aplay or it could not be opened (e.g. no
+    # sounddevice), in which case audio goes to one player process per sample rate as before.
+    global _sink, _sink_failed, _sd_device_index
+    if TTS_SINK == "aplay" or _sink_failed:
+        return None
+    with _out_lock:
+        if _sink is None:
             try:
-                _sd_stream = sd.RawOutputStream(
-                    samplerate=_sample_rate,
-                    channels=1,
-                    dtype="int16",
-                    blocksize=2048,
-                    device=_sd_device_index,
-                    latency="low",
-                )
-                _sd_stream.start()
+                import audio_sink
+                device = None
+                if TTS_SINK == "sounddevice":
+                    if IS_WINDOWS and _sd_device_index is None:
+                        _sd_device_index = _pick_windows_output_device()
+                    # sounddevice matches a name substring, and ALSA devices show up as "... (hw:1,0)".
+                    alsa = ALSA_DEVICE if "ALSA_DEVICE" in os.environ and ALSA_DEVICE != "default" else None
+                    device = _sd_device_index if IS_WINDOWS else (os.environ.get("TTS_SD_DEVICE") or alsa)
+                _sink = audio_sink.open_sink(TTS_SINK, OUTPUT_RATE, device)
+                _log(f"[DAEMON] Audio sink '{TTS_SINK}' at {OUTPUT_RATE} Hz" + (f" on {device!r}" if device is not None else ""))
+                if USE_SOX_FADE:
+                    _log(f"[DAEMON] USE_SOX_FADE has no effect with TTS_SINK={TTS_SINK}; the sink fades by FADE_MS itself")
             except Exception as e:
-                _log("[DAEMON] Failed to open Windows audio stream:", e)
-                _sd_stream = None
-
-            def _feeder(local_stream, local_stdout):
-                try:
-                    while not _stop_feeder.is_set():
-                        chunk = local_stdout.read(4096)
-                        if not chunk:
-                            time.sleep(0.002)
-                            continue
-                        if local_stream is not None:
-                            try:
-                                local_stream.write(chunk)
-                            except Exception as ee:
-                                _log("[DAEMON] Windows feeder write error:", ee)
-                                time.sleep(0.02)
-                        else:
-                            time.sleep(0.01)
-                except Exception as e:
-                    _log("[DAEMON] Windows feeder error:", e)
-
-            _sd_thread = threading.Thread(
-                target=_feeder,
-                args=(_sd_stream, _piper_proc.stdout),
-                daemon=True
-            )
-            _sd_thread.start()
-
+                _sink_failed = True
+                _log("[DAEMON] In-process audio sink unavailable, using player processes:", e)
+        return _sink
+
+def _preparer(sample_rate: int):
+    # Resamples, loudness-normalizes and fades one sentence for the in-process sink as its audio
+    # arrives. None when audio goes to the player processes as Piper wrote it.
+    sink = _get_sink()
+    if sink is None:
+        return None, sample_rate
+    import audio_sink
+    return audio_sink.StreamPrep(sample_rate, sink.rate, FADE_MS, TARGET_DBFS), sink.rate
+
+def _write_audio(chunk: bytes, sample_rate: int) -> float:
+    # Single entry point to the output devices. Returns the wall time at which this chunk starts
+    # to play. With the in-process sink that comes from its ring fill level; player processes
+    # (one per sample rate) use a clock that advances by each chunk's duration.
+    sink = _get_sink()
+    if sink is not None:
+        return sink.write(chunk)
+    with _out_lock:
+        out = _outputs.get(sample_rate)
+        if out is None or (not IS_WINDOWS and out.poll() is not None):
+            out = _outputs[sample_rate] = _open_output(sample_rate)
+        if out is None:
+            return time.time()
+        start = max(time.time() + OUTPUT_LATENCY_S, _play_until.get(sample_rate, 0.0))
+        _play_until[sample_rate] = start + len(chunk) / (2.0 * sample_rate)
+        if IS_WINDOWS:
+            out.write(chunk)
         else:
-            player_cmd = _player_cmd_linux(_sample_rate)
-            _player_proc = subprocess.Popen(
-                player_cmd,
-                stdin=_piper_proc.stdout,
-                stdout=subprocess.DEVNULL,
+            out.stdin.write(chunk)
+            out.stdin.flush()
+        return start
+
+def _flush_outputs():
+    # Drops audio already handed to the device. Runs without _out_lock because a writer may be
+    # blocked inside it on a full pipe; killing the player unblocks it. Players reopen lazily.
+    if _sink is not None:
+        _sink.flush()
+    for out in list(_outputs.values()):
+        try:
+            if IS_WINDOWS:
+                out.abort(); out.start()
+            else:
+                out.kill(); out.wait(timeout=0.2)
+        except Exception:
+            pass
+    _play_until.clear()
+
+def _close_outputs():
+    global _sink
+    with _out_lock:
+        if _sink is not None:
+            _sink.close(); _sink = None
+        for out in _outputs.values():
+            try:
+                if IS_WINDOWS:
+                    out.stop(); out.close()
+                else:
+                    out.stdin.close(); out.terminate(); out.wait(timeout=1)
+            except Exception:
+                try: out.kill()
+                except Exception: pass
+        _outputs.clear()
+
+class _Voice:
+    # One warm Piper process per language. Its raw output is relayed to the shared output for
+    # its sample rate; _supervise() restarts the process if it dies.
+    def __init__(self, lang: str, model: str):
+        self.lang = lang
+        self.model = model
+        self.sample_rate = _read_sample_rate(model)
+        self.proc = None
+        self.restarts = 0
+        self.next_restart = 0.0
+        self.lock = threading.Lock()
+        self.synth_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.buf = bytearray()
+        self.open = False  # a sentence is waiting for its audio; output outside one is dropped
+        self.last_data = 0.0
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self) -> bool:
+        cmd = _piper_cmd(self.model)
+        _log("[DAEMON] exec:", " ".join(cmd))
+        try:
+            self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
+                env=_env,
             )
-            threading.Thread(target=_drain_stderr, args=("player", _player_proc), daemon=True).start()
+        except Exception as e:
+            _log(f"[DAEMON] Failed to start Piper for '{self.lang}':", e)
+            self.proc = None
+            return False
+        threading.Thread(target=_drain_stderr, args=(f"piper-{self.lang}", self.proc), daemon=True).start()
+        threading.Thread(target=self._relay, args=(self.proc.stdout,), daemon=True).start()
+        _log(f"[DAEMON] Voice '{self.lang}' started at {self.sample_rate} Hz (HOT)")
+        return True
+
+    def _relay(self, stdout):
+        try:
+            while True:
+                chunk = stdout.read1(4096)
+                if not chunk:
+                    break
+                with self.cond:
+                    if self.open:
+                        self.buf += chunk
+                        self.last_data = time.time()
+                        self.cond.notify_all()
+        except Exception as e:
+            _log(f"[DAEMON] relay error ({self.lang}):", e)
+        with self.cond:
+            self.cond.notify_all()
+
+    def stream(self, text: str):
+        # Feeds one sentence and yields its audio as Piper writes it, in whole samples. Piper
+        # writes each sentence in one burst, so the quiet gap of IDLE_S after output started only
+        # marks the end; output arriving after that is dropped rather than left for the next one.
+        with self.synth_lock:
+            with self.cond:
+                self.buf = bytearray()
+                self.open = True
+            try:
+                if not self.feed(text):
+                    return
+                deadline = time.time() + 5.0 + 0.1 * len(text)
+                started = False
+                while True:
+                    with self.cond:
+                        while len(self.buf) < 2:
+                            now = time.time()
+                            if started and now - self.last_data >= IDLE_S:
+                                return
+                            if now > deadline or not self.alive():
+                                return
+                            self.cond.wait(IDLE_S / 2)
+                        n = len(self.buf) & ~1
+                        chunk = bytes(self.buf[:n])
+                        del self.buf[:n]
+                    started = True
+                    yield chunk
+            finally:
+                with self.cond:
+                    self.open = False
+                    self.buf = bytearray()
+
+    def feed(self, text: str) -> bool:
+        with self.lock:
+            if not self.alive():
+                return False
+            try:
+                self.proc.stdin.write(_piper_line(text))
+                self.proc.stdin.flush()
+                return True
+            except Exception as e:
+                _log("[DAEMON] Piper stdin error:", e)
+                return False
 
-        _cur_lang = lang
-        _log(f"[DAEMON] Pipeline started for '{lang}' at {_sample_rate} Hz (HOT)")
+    def stop(self):
+        with self.lock:
+            proc, self.proc = self.proc, None
+        if proc:
+            try:
+                proc.terminate(); proc.wait(timeout=1)
+            except Exception:
+                try: proc.kill()
+                except Exception: pass
+
+class _OnnxVoice:
+    # Same interface as _Voice, but the model runs in this process through onnxruntime: no
+    # Piper process, no pipes, and all voices share one runtime. The supervisor leaves it alone.
+    def __init__(self, lang: str, model: str):
+        self.lang = lang
+        self.model = model
+        self.sample_rate = _read_sample_rate(model)
+        self.proc = None
+        self.engine = None
+        self.lock = threading.Lock()
+
+    def alive(self) -> bool:
+        return self.engine is not None
+
+    def start(self) -> bool:
+        import piper_onnx
+        t0 = time.time()
+        try:
+            self.engine = piper_onnx.PiperVoice(self.model, threads=int(OMP_THREADS))
+        except Exception as e:
+            _log(f"[DAEMON] Failed to load ONNX voice '{self.lang}':", e)
+            return False
+        self.sample_rate = self.engine.sample_rate
+        _log(f"[DAEMON] Voice '{self.lang}' loaded in-process at {self.sample_rate} Hz ({time.time()-t0:.2f}s)")
         return True
 
-    except Exception as e:
-        _log("[DAEMON] Failed to start pipeline:", e)
-        _stop_pipeline()
-        return False
+    def synth(self, text: str) -> bytes:
+        engine = self.engine
+        return engine.synthesize(text).tobytes() if engine else b""
 
-def _stop_pipeline():
-    global _piper_proc, _cur_lang, _sd_stream, _sd_thread, _stop_feeder
+    def stream(self, text: str):
+        pcm = self.synth(text)
+        if pcm:
+            yield pcm
 
-    if IS_WINDOWS:
-        try:
-            _stop_feeder.set()
-            if _sd_thread and _sd_thread.is_alive():
-                _sd_thread.join(timeout=0.3)
-        except Exception:
-            pass
-        _sd_thread = None
-        try:
-            if _sd_stream:
-                _sd_stream.stop()
-                _sd_stream.close()
-        except Exception:
-            pass
-        _sd_stream = None
+    def stop(self):
+        self.engine = None
 
-    if _piper_proc:
+def _new_voice(lang: str, model: str):
+    if TTS_ENGINE == "onnx":
         try:
-            _piper_proc.terminate(); _piper_proc.wait(timeout=1)
-        except Exception:
-            try: _piper_proc.kill()
-            except Exception: pass
-    _piper_proc = None
-    _cur_lang = None
+            import piper_onnx  # noqa: F401  (optional: onnxruntime, numpy, piper_phonemize/espeak-ng)
+            return _OnnxVoice(lang, model)
+        except ImportError as e:
+            _log("[DAEMON] ONNX engine unavailable, using the piper binary:", e)
+    return _Voice(lang, model)
+
+def _voice(lang: str):
+    with _voices_lock:
+        v = _voices.get(lang)
+        if v is None:
+            model = VOICE_MAP.get(lang)
+            if not model or not os.path.exists(model) or not os.path.exists(model + ".json"):
+                _log(f"[DAEMON] Missing model/config for '{lang}': {model}")
+                return None
+            v = _voices[lang] = _new_voice(lang, model)
+    with v.lock:
+        if not v.alive() and not v.start():
+            return None
+    return v
+
+def _supervise():
+    # Restarts voices whose Piper process exited, backing off if one keeps crashing.
+    while not _stopping.wait(SUPERVISE_S):
+        for v in list(_voices.values()):
+            with v.lock:
+                if v.proc is None or v.alive() or time.time() < v.next_restart:
+                    continue
+                v.restarts += 1
+                v.next_restart = time.time() + min(30.0, 2.0 ** min(v.restarts, 5))
+                _log(f"[DAEMON] Voice '{v.lang}' exited with code {v.proc.returncode}; restart #{v.restarts}")
+                v.start()
+
+# -------------------- PCM cache --------------------
+
+@lru_cache(maxsize=8)
+def _model_hash(path: str, size: int, mtime: float) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+def _cache_path(text: str, lang: str):
+    model = VOICE_MAP.get(lang)
+    if not model or not os.path.exists(model):
+        return None
+    st = os.stat(model)
+    key = "\0".join([" ".join(text.split()), os.path.basename(model), _model_hash(model, st.st_size, st.st_mtime)])
+    return os.path.join(TTS_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pcm")
 
-def _feed_text(line: str) -> bool:
-    if not _piper_proc or _piper_proc.poll() is not None:
-        return False
+def _cache_get(text: str, lang: str):
+    path = _cache_path(text, lang)
+    if not path or not os.path.exists(path):
+        return None
     try:
-        payload = line.strip() + ("\n" if not line.endswith("\n") else "")
-        assert _piper_proc.stdin is not None
-        if IS_WINDOWS:
-            data = json.dumps({"text": payload.strip()}) + "\n"
-            _piper_proc.stdin.write(data.encode("utf-8"))
-        else:
-            _piper_proc.stdin.write(payload.encode("utf-8"))
-        _piper_proc.stdin.flush()
-        return True
-    except Exception as e:
-        _log("[DAEMON] Piper stdin error:", e)
-        return False
+        with open(path, "rb") as f:
+            pcm = f.read()
+        os.utime(path)  # LRU: mtime is the last use
+        return pcm
+    except Exception:
+        return None
+
+def _cache_prune():
+    try:
+        files = [os.path.join(TTS_CACHE_DIR, n) for n in os.listdir(TTS_CACHE_DIR) if n.endswith(".pcm")]
+        files = sorted(((os.stat(p).st_mtime, os.stat(p).st_size, p) for p in files), reverse=True)
+    except Exception:
+        return
+    total, limit = 0, TTS_CACHE_MAX_MB * 1024 * 1024
+    for _, size, p in files:
+        total += size
+        if total > limit:
+            try: os.remove(p)
+            except Exception: pass
+
+def _cache_put(text: str, lang: str, pcm: bytes):
+    path = _cache_path(text, lang)
+    if not path or not pcm:
+        return
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(pcm)
+    os.replace(tmp, path)
+    _cache_prune()
+
+def _render_pcm(text: str, lang: str) -> bytes:
+    # One-shot Piper run used to fill the cache; the hot pipeline keeps serving live requests.
+    # The in-process engine can render concurrently, so it is used directly.
+    v = _voice(lang) if TTS_ENGINE == "onnx" else None
+    if isinstance(v, _OnnxVoice):
+        return v.synth(text)
+    model = VOICE_MAP.get(lang)
+    proc = subprocess.run(_piper_cmd(model), input=_piper_line(text), capture_output=True, env=_env, timeout=60)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.decode("utf-8", "ignore").strip() or "piper failed")
+    return proc.stdout
+
+def _cache_later(text: str, lang: str):
+    # Frequent phrases get rendered in the background once they were requested TTS_CACHE_AFTER times.
+    if TTS_CACHE_AFTER <= 0 or len(text) > TTS_CACHE_MAX_CHARS:
+        return
+    key = (lang, " ".join(text.split()))
+    n = _cache_counts[key] = _cache_counts.get(key, 0) + 1
+    if len(_cache_counts) > 4096:
+        _cache_counts.clear()
+    if n != TTS_CACHE_AFTER:
+        return
+    def work():
+        try: _cache_put(text, lang, _render_pcm(text, lang))
+        except Exception as e: _log("[DAEMON] cache render failed:", e)
+    threading.Thread(target=work, daemon=True).start()
+
+def warmup(phrases):
+    n = 0
+    for lang, text in phrases:
+        if _cache_get(text, lang) is not None:
+            continue
+        try:
+            _cache_put(text, lang, _render_pcm(text, lang)); n += 1
+            _log(f"[DAEMON] cached [{lang}] {text}")
+        except Exception as e:
+            _log(f"[DAEMON] warmup failed for [{lang}] {text}: {e}")
+    return n
+
+# -------------------- Utterances --------------------
+
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»“”)\]]*(?:\s+|$)|\n+")
+_ABBREV = {
+    "en": {"mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "e.g", "i.e", "no", "approx"},
+    "de": {"dr", "prof", "hr", "fr", "nr", "str", "ca", "bzw", "usw", "vgl", "ggf", "evtl", "inkl",
+           "z.b", "d.h", "u.a", "o.ä", "s.o", "etc", "bspw", "sog"},
+}
 
-def _speak(text: str, lang: str) -> bool:
-    global _cur_lang
+def _split_sentences(text: str, lang: str = "en"):
+    # Splits at sentence punctuation and newlines, but not after abbreviations ("Dr.", "z.B."),
+    # initials, or German ordinals ("am 3. Mai").
+    abbrev = _ABBREV.get(lang, _ABBREV["en"])
+    out, start = [], 0
+    for m in _SENTENCE_END.finditer(text):
+        punct = m.group().strip()
+        if punct == ".":
+            words = text[start:m.start()].split()
+            last = words[-1].lower() if words else ""
+            if last in abbrev or (len(last) == 1 and last.isalpha()) or (lang == "de" and last.isdigit()):
+                continue
+        piece = text[start:m.end()].strip()
+        if piece:
+            out.append(piece)
+        start = m.end()
+    rest = text[start:].strip()
+    if rest:
+        out.append(rest)
+    return out
+
+class _Utterance:
+    # One speak request tracked through synthesis and playback. "started" and "finished"
+    # events go back to the requesting connection, tagged with the request id.
+    def __init__(self, conn, rid, text: str, lang: str, turn=None):
+        self.conn, self.rid = conn, rid
+        self.text, self.lang = text, lang
+        self.turn = turn  # trace id of the bear's turn, if it sent one
+        self.queued_ts = time.time()
+        self.started_ts = None
+        self.end_ts = None
+        self.cancelled = False
+        self._done = False
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _event(self, name: str, **kw):
+        if self.conn is not None and self.rid is not None:
+            self.conn.send(dict(kw, id=self.rid, event=name))
+
+    def play(self, chunks: queue.Queue, sample_rate: int):
+        # Plays one sentence while it is still being synthesized; `chunks` ends with None.
+        # Written in ~100 ms pieces so a cancel takes effect between them.
+        prep, sample_rate = _preparer(sample_rate)
+        step = max(2, int(sample_rate * 0.1) * 2)
+        while True:
+            pcm = chunks.get()
+            last = pcm is None
+            if self.cancelled:
+                return
+            if prep is not None:
+                pcm = (prep.finish() if last else prep.feed(pcm)).tobytes()
+            elif last:
+                return
+            for i in range(0, len(pcm), step):
+                if self.cancelled:
+                    return
+                chunk = pcm[i:i + step]
+                try:
+                    start = _write_audio(chunk, sample_rate)
+                except Exception as e:
+                    if not self.cancelled:
+                        _log("[DAEMON] audio write error:", e)
+                    return
+                if self.started_ts is None:
+                    self.started_ts = start
+                    self._event("started", ts=start, queued_ts=self.queued_ts)
+                self.end_ts = start + len(chunk) / (2.0 * sample_rate)
+            if last:
+                return
+
+    def schedule_finish(self):
+        delay = max(0.0, (self.end_ts or 0.0) - time.time())
+        with self._lock:
+            if self._done:
+                return
+            self._timer = threading.Timer(delay, self.finish)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def finish(self, cancelled: bool = False, error: str = ""):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+            if self._timer:
+                self._timer.cancel()
+        ev = {"ts": time.time(), "queued_ts": self.queued_ts, "started_ts": self.started_ts, "cancelled": cancelled}
+        if error:
+            ev["error"] = error
+        self._event("finished", **ev)
+        turn_trace.emit("tts", self.turn, "utterance", self.queued_ts, ev["ts"], first_audio=self.started_ts,
+                        chars=len(self.text), cancelled=cancelled, error=error or None)
+
+    def cancel(self):
+        self.cancelled = True
+        self.finish(cancelled=True)
+
+def _render(utt: _Utterance):
+    # Synthesizes sentence by sentence into _rendered. The queue is bounded, so synthesis runs at
+    # most LOOKAHEAD sentences ahead of playback and the next sentence is ready when one ends.
+    voice = _voice(utt.lang)
+    if voice is None:
+        utt.finish(error="no_voice"); return
+    pcm = _cache_get(utt.text, utt.lang)
+    if pcm is not None:
+        chunks = queue.Queue()
+        chunks.put(pcm); chunks.put(None)
+        _rendered.put((utt, chunks, voice.sample_rate))
+    else:
+        _cache_later(utt.text, utt.lang)
+        for sentence in _split_sentences(utt.text, utt.lang):
+            if utt.cancelled:
+                break
+            # A sentence goes to playback with its first chunk; the rest follows as Piper writes it.
+            t0, first, chunks = time.time(), None, queue.Queue()
+            for pcm in voice.stream(sentence):
+                if utt.cancelled:
+                    continue  # drain: the voice is busy until this sentence has ended anyway
+                if first is None:
+                    first = time.time()
+                    _rendered.put((utt, chunks, voice.sample_rate))
+                chunks.put(pcm)
+            chunks.put(None)
+            turn_trace.emit("tts", utt.turn, "synth", t0, time.time(), chars=len(sentence), first_chunk=first)
+    _rendered.put((utt, None, voice.sample_rate))
+
+def _synth_worker():
+    # Utterances are synthesized strictly in arrival order, across all voices, and the next
+    # utterance starts rendering while the previous one is still playing.
+    while True:
+        utt = _utterances.get()
+        with _inflight_lock:
+            _inflight.add(utt)
+        try:
+            if not utt.cancelled:
+                _render(utt)
+        except Exception as e:
+            _log("[DAEMON] speech error:", e)
+            utt.finish(error="internal")
+            _rendered.put((utt, None, 0))
+
+def _play_worker():
+    while True:
+        utt, chunks, sample_rate = _rendered.get()
+        if chunks is not None:
+            if not utt.cancelled:
+                utt.play(chunks, sample_rate)
+            continue
+        with _inflight_lock:
+            _inflight.discard(utt)
+        if not utt.cancelled:
+            utt.schedule_finish()
+
+def _utterance(text: str, lang: str, conn=None, rid=None, turn=None):
     lang = (lang or "en").split("-")[0].lower()
     if lang not in VOICE_MAP:
         lang = "en"
-    if _cur_lang != lang:
-        if not _start_pipeline(lang):
-            return False
-    return _feed_text(text)
-
-def _handle_conn(conn: socket.socket):
+    if _voice(lang) is None:
+        return None
+    return _Utterance(conn, rid, text, lang, turn)
+
+def _cancel_all() -> int:
+    # Barge-in: drop queued utterances, stop the current one and flush the device buffers.
+    dropped = []
+    while True:
+        try: dropped.append(_utterances.get_nowait())
+        except queue.Empty: break
+    with _inflight_lock:
+        dropped += _inflight
+    for utt in dropped:
+        utt.cancel()
+    _flush_outputs()
+    return len(dropped)
+
+class _Conn:
+    # A long-lived client connection. Requests carry an "id" that is echoed on every reply, so
+    # clients can pipeline; sends are serialized because replies may come from other threads.
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, obj: dict) -> bool:
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        with self.lock:
+            try:
+                self.sock.sendall(data); return True
+            except OSError:
+                return False
+
+def _handle_request(conn: _Conn, req: dict):
+    rid = req.get("id")
+    def reply(obj):
+        if rid is not None:
+            obj["id"] = rid
+        conn.send(obj)
+    op = req.get("op") or "speak"
+    if op == "cancel":
+        reply({"ok": True, "cancelled": _cancel_all()}); return
+    if op == "warm":
+        # Sent by main.py at boot: start the voices it will use and open the output now.
+        langs = [l for l in (req.get("languages") or list(VOICE_MAP)) if l in VOICE_MAP]
+        ready = [l for l in langs if _voice(l) is not None]
+        _get_sink()
+        reply({"ok": len(ready) == len(langs), "voices": ready}); return
+    text = (req.get("text") or "").strip()
+    lang = (req.get("language") or "en").strip().lower()
+    if not text:
+        reply({"ok": False, "error": "no_text"}); return
+    # The ok reply means "queued"; "started"/"finished" events follow for requests with an id,
+    # so the reply goes out before the utterance can reach the worker.
+    utt = _utterance(text, lang, conn, rid, req.get("turn"))
+    if utt is None:
+        reply({"ok": False, "error": "speak_failed"}); return
+    reply({"ok": True})
+    _utterances.put(utt)
+
+def _handle_conn(sock: socket.socket):
+    # One thread per connection, not per utterance. Old one-shot clients send a single line
+    # without an id, read the reply and close, which ends this loop.
+    conn = _Conn(sock)
     try:
-        data = b""
-        while b"\n" not in data:
-            chunk = conn.recv(4096)
+        buf = b""
+        while True:
+            chunk = sock.recv(4096)
             if not chunk: break
-            data += chunk
-        msg = data.decode("utf-8", "ignore").strip()
-        if not msg:
-            conn.sendall(b'{"ok":false,"error":"empty"}\n'); return
-        req = json.loads(msg)
-        text = (req.get("text") or "").strip()
-        lang = (req.get("language") or "en").strip().lower()
-        if not text:
-            conn.sendall(b'{"ok":false,"error":"no_text"}\n'); return
-        ok = _speak(text, lang)
-        conn.sendall(b'{"ok":true}\n' if ok else b'{"ok":false,"error":"speak_failed"}\n')
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                msg = line.decode("utf-8", "ignore").strip()
+                if not msg:
+                    continue
+                try:
+                    req = json.loads(msg)
+                except ValueError:
+                    conn.send({"ok": False, "error": "bad_json"}); continue
+                try:
+                    _handle_request(conn, req)
+                except Exception as e:
+                    _log("[DAEMON] request error:", e)
+                    conn.send({"ok": False, "error": "internal", "id": req.get("id")})
     except Exception as e:
-        try: conn.sendall(b'{"ok":false,"error":"internal"}\n')
-        except Exception: pass
         _log("[DAEMON] client error:", e)
     finally:
-        try: conn.close()
+        try: sock.close()
         except Exception: pass
 
+def _accept_loop(s: socket.socket):
+    while True:
+        conn, _ = s.accept()
+        threading.Thread(target=_handle_conn, args=(conn,), daemon=True).start()
+
 def _serve():
     _log(f"[DAEMON] Piper: {PIPER_BIN}")
     if IS_WINDOWS and ESPEAK_DATA:
         _log(f"[DAEMON] eSpeak data: {ESPEAK_DATA}")
-    _log(f"[DAEMON] Listening on {HOST}:{PORT}")
-    if PRESTART_LANG:
-        _start_pipeline(PRESTART_LANG)
+    langs = list(VOICE_MAP) if PRESTART_LANG.strip().lower() == "all" else [l.strip().lower() for l in PRESTART_LANG.split(",") if l.strip()]
+    for lang in langs:
+        _voice(lang)
+    threading.Thread(target=_supervise, daemon=True).start()
+    threading.Thread(target=_synth_worker, daemon=True).start()
+    threading.Thread(target=_play_worker, daemon=True).start()
+    # Hash the voice models up front so the first cache lookup does not pay for it.
+    threading.Thread(target=lambda: [_cache_path("", l) for l in VOICE_MAP], daemon=True).start()
+    if SOCK_PATH and hasattr(socket, "AF_UNIX"):
+        try:
+            if os.path.exists(SOCK_PATH):
+                os.unlink(SOCK_PATH)
+            us = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            us.bind(SOCK_PATH); us.listen(5)
+            threading.Thread(target=_accept_loop, args=(us,), daemon=True).start()
+            _log(f"[DAEMON] Listening on {SOCK_PATH}")
+        except OSError as e:
+            _log("[DAEMON] Unix socket disabled:", e)
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((HOST, PORT)); s.listen(5)
-        while True:
-            conn, _ = s.accept()
-            threading.Thread(target=_handle_conn, args=(conn,), daemon=True).start()
+        _log(f"[DAEMON] Listening on {HOST}:{PORT}")
+        _accept_loop(s)
 
 def _shutdown(*_):
-    _stop_pipeline(); sys.exit(0)
+    _stopping.set()
+    for v in list(_voices.values()):
+        v.stop()
+    _close_outputs()
+    if SOCK_PATH and os.path.exists(SOCK_PATH):
+        try: os.unlink(SOCK_PATH)
+        except OSError: pass
+    sys.exit(0)
+
+# Fixed prompts from main.py. Lines with the child's name cannot be rendered ahead; like any phrase
+# they are cached by _cache_later() once requested TTS_CACHE_AFTER times.
+WARMUP_PHRASES = [
+    ("en", "Hello! What language should I use: German or English?"),
+    ("en", "I didn't hear anything. Please say German or English."),
+    ("en", "Sorry, I didn't understand. Please say German or English."),
+    ("de", "Okay, dann spreche ich nun Deutsch."),
+    ("en", "Okay, I will continue to speak English."),
+    ("de", "Wie heißt du? Halte die Taste und sag deinen Namen."),
+    ("en", "What is your name? Hold the button and say your name."),
+    ("de", "Bitte sag nur deinen Vornamen."),
+    ("en", "Please say just your first name."),
+    ("de", "Ich nenne dich Freund."),
+    ("en", "I'll call you Friend."),
+    ("en", "Sorry, I couldn't reach the AI server."),
+]
+
+def _read_phrases(path):
+    # One phrase per line, optionally prefixed with "en|" or "de|".
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            lang, _, text = line.partition("|") if "|" in line[:4] else ("en", "", line)
+            out.append((lang.strip(), text.strip()))
+    return out
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "warmup":
+        # python TTS_daemon.py warmup [phrases.txt]
+        from TTS import _sanitize_text
+        phrases = _read_phrases(sys.argv[2]) if len(sys.argv) > 2 else WARMUP_PHRASES
+        n = warmup([(lang, _sanitize_text(text)) for lang, text in phrases])
+        _log(f"[DAEMON] warmup rendered {n} phrase(s) into {TTS_CACHE_DIR}")
+        sys.exit(0)
     signal.signal(signal.SIGINT, _shutdown)
     signal.signal(signal.SIGTERM, _shutdown)
     _serve()
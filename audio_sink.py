@@ -0,0 +1,239 @@
+import threading, time, wave
+import numpy as np
+
+# -------------------- Signal helpers --------------------
+
+def resample(x: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    # Linear interpolation; plenty for speech between the 16-24 kHz rates Piper voices use.
+    if src_rate == dst_rate or not x.size:
+        return x.astype(np.float32)
+    n = int(round(x.size * dst_rate / float(src_rate)))
+    t = np.arange(n, dtype=np.float64) * (src_rate / float(dst_rate))
+    return np.interp(t, np.arange(x.size), x).astype(np.float32)
+
+def normalize(x: np.ndarray, target_dbfs: float = -20.0, max_gain: float = 4.0) -> np.ndarray:
+    # RMS loudness to target_dbfs, capped at max_gain and so the peak stays below full scale.
+    rms = float(np.sqrt(np.mean(np.square(x, dtype=np.float64)))) if x.size else 0.0
+    if rms < 1.0:
+        return x
+    gain = min(max_gain, 32767.0 * 10 ** (target_dbfs / 20.0) / rms)
+    peak = float(np.max(np.abs(x)))
+    if peak * gain > 32000.0:
+        gain = 32000.0 / peak
+    return x * gain
+
+def fade(x: np.ndarray, rate: int, fade_s: float) -> np.ndarray:
+    n = min(int(rate * fade_s), x.size // 2)
+    if n > 0:
+        ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+        x[:n] *= ramp
+        x[-n:] *= ramp[::-1]
+    return x
+
+def prepare(pcm: bytes, src_rate: int, dst_rate: int, fade_s: float = 0.012, target_dbfs=-20.0) -> np.ndarray:
+    # One sentence of Piper int16 PCM -> int16 at the sink rate, loudness matched and faded so
+    # sentence boundaries do not click.
+    x = resample(np.frombuffer(pcm, dtype=np.int16), src_rate, dst_rate)
+    if target_dbfs is not None:
+        x = normalize(x, target_dbfs)
+    x = fade(x, dst_rate, fade_s)
+    return np.clip(x, -32768, 32767).astype(np.int16)
+
+class StreamPrep:
+    # prepare() for one sentence whose audio arrives in pieces. The loudness gain is fixed from
+    # the first gain_s of audio, which is held back until then (Piper delivers that much well
+    # ahead of real time), and the last fade window is held back so finish() can fade out the
+    # real end. Resampling carries its position across pieces, so there are no seams.
+    def __init__(self, src_rate: int, dst_rate: int, fade_s: float = 0.012, target_dbfs=-20.0, gain_s: float = 0.3):
+        self.step = src_rate / float(dst_rate)
+        self.resampling = src_rate != dst_rate
+        self.target_dbfs = target_dbfs
+        self.n_fade = int(dst_rate * fade_s)
+        self.n_gain = int(dst_rate * gain_s)
+        self.gain = None if target_dbfs is not None else 1.0
+        self.faded_in = False
+        self.src = np.zeros(0, dtype=np.float32)  # input not yet consumed, plus the last sample
+        self.t = 0.0                              # next output position within self.src
+        self.odd = b""
+        self.held = np.zeros(0, dtype=np.float32)
+
+    def _resample(self, x: np.ndarray) -> np.ndarray:
+        if not self.resampling:
+            return x
+        src = np.concatenate([self.src, x])
+        if src.size < 2:
+            self.src = src
+            return np.zeros(0, dtype=np.float32)
+        n = int((src.size - 1 - self.t) // self.step) + 1
+        pos = self.t + np.arange(n, dtype=np.float64) * self.step
+        out = np.interp(pos, np.arange(src.size), src).astype(np.float32)
+        self.t = pos[-1] + self.step - (src.size - 1)
+        self.src = src[-1:]
+        return out
+
+    def _emit(self, keep: int) -> np.ndarray:
+        if self.gain is None:
+            if self.held.size < self.n_gain and keep:
+                return np.zeros(0, dtype=np.int16)
+            head = self.held[:max(self.n_gain, 1)]
+            rms = float(np.sqrt(np.mean(np.square(head, dtype=np.float64)))) if head.size else 0.0
+            peak = float(np.max(np.abs(head))) if head.size else 0.0
+            self.gain = 1.0 if rms < 1.0 else min(4.0, 32767.0 * 10 ** (self.target_dbfs / 20.0) / rms)
+            if peak * self.gain > 32000.0:
+                self.gain = 32000.0 / peak
+        n = max(0, self.held.size - keep)
+        out, self.held = self.held[:n] * self.gain, self.held[n:]
+        if not self.faded_in and out.size:
+            k = min(self.n_fade, out.size)
+            out[:k] *= np.linspace(0.0, 1.0, k, dtype=np.float32)
+            self.faded_in = True
+        return np.clip(out, -32768, 32767).astype(np.int16)
+
+    def feed(self, pcm: bytes) -> np.ndarray:
+        pcm = self.odd + pcm
+        cut = len(pcm) & ~1
+        self.odd = pcm[cut:]
+        x = np.frombuffer(pcm[:cut], dtype=np.int16).astype(np.float32)
+        self.held = np.concatenate([self.held, self._resample(x)])
+        return self._emit(self.n_fade)
+
+    def finish(self) -> np.ndarray:
+        k = min(self.n_fade, self.held.size)
+        if k:
+            self.held[-k:] *= np.linspace(1.0, 0.0, k, dtype=np.float32)
+        return self._emit(0)
+
+# -------------------- Ring buffer --------------------
+
+class Ring:
+    # Single-producer/single-consumer int16 ring. The writer only moves `w` and the reader only
+    # moves `r`, so neither side takes a lock; the audio callback never blocks on the writer.
+    def __init__(self, capacity: int):
+        self.buf = np.zeros(capacity, dtype=np.int16)
+        self.cap = capacity
+        self.r = 0
+        self.w = 0
+
+    def size(self) -> int:
+        return self.w - self.r
+
+    def write(self, x: np.ndarray) -> int:
+        n = min(x.size, self.cap - (self.w - self.r))
+        if n <= 0:
+            return 0
+        i = self.w % self.cap
+        k = min(n, self.cap - i)
+        self.buf[i:i + k] = x[:k]
+        self.buf[:n - k] = x[k:n]
+        self.w += n
+        return n
+
+    def read_into(self, out: np.ndarray) -> int:
+        n = min(out.size, self.w - self.r)
+        i = self.r % self.cap
+        k = min(n, self.cap - i)
+        out[:k] = self.buf[i:i + k]
+        out[k:n] = self.buf[:n - k]
+        self.r += n
+        return n
+
+# -------------------- Sinks --------------------
+
+class _Sink:
+    # Writers call write() with int16 samples at self.rate; it blocks while the ring is full and
+    # returns the wall time at which the first sample will be heard. flush() drops everything
+    # queued (barge-in) and makes a blocked write() return early.
+    latency = 0.0
+
+    def __init__(self, rate: int, buffer_s: float = 1.0):
+        self.rate = rate
+        self.ring = Ring(int(rate * buffer_s))
+        self._space = threading.Event()
+        self._flush = False
+        self._gen = 0
+
+    def _consume(self, out: np.ndarray) -> int:
+        if self._flush:
+            self.ring.r = self.ring.w
+            self._flush = False
+        n = self.ring.read_into(out)
+        out[n:] = 0
+        self._space.set()
+        return n
+
+    def write(self, x) -> float:
+        if isinstance(x, (bytes, bytearray)):
+            x = np.frombuffer(x, dtype=np.int16)
+        start = time.time() + self.latency + self.ring.size() / float(self.rate)
+        gen, i = self._gen, 0
+        while i < x.size and gen == self._gen:
+            i += self.ring.write(x[i:])
+            if i < x.size:
+                self._space.clear()
+                self._space.wait(0.1)
+        return start
+
+    def flush(self):
+        self._gen += 1
+        self._flush = True
+        self._space.set()
+
+    def close(self):
+        pass
+
+class DeviceSink(_Sink):
+    # sounddevice OutputStream pulling from the ring in its callback; underruns play silence.
+    def __init__(self, rate: int, device=None, blocksize: int = 512, buffer_s: float = 1.0):
+        import sounddevice as sd
+        super().__init__(rate, buffer_s)
+        self.stream = sd.OutputStream(samplerate=rate, channels=1, dtype="int16", blocksize=blocksize,
+                                      device=device, latency="low", callback=self._callback)
+        self.stream.start()
+        self.latency = float(self.stream.latency or 0.0)
+
+    def _callback(self, outdata, frames, time_info, status):
+        self._consume(outdata[:, 0])
+
+    def close(self):
+        try:
+            self.stream.stop(); self.stream.close()
+        except Exception:
+            pass
+
+class NullSink(_Sink):
+    # Headless stand-in for a device: a clock thread consumes the ring in real time, optionally
+    # recording what would have been played to a WAV file.
+    def __init__(self, rate: int, wav_path: str = "", block_s: float = 0.02, buffer_s: float = 1.0):
+        super().__init__(rate, buffer_s)
+        self.block = np.zeros(max(1, int(rate * block_s)), dtype=np.int16)
+        self.wav = None
+        if wav_path:
+            self.wav = wave.open(wav_path, "wb")
+            self.wav.setnchannels(1); self.wav.setsampwidth(2); self.wav.setframerate(rate)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        period = self.block.size / float(self.rate)
+        nxt = time.time()
+        while not self._stop.is_set():
+            n = self._consume(self.block)
+            if self.wav is not None and n:
+                self.wav.writeframes(self.block[:n].tobytes())
+            nxt += period
+            self._stop.wait(max(0.0, nxt - time.time()))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(1.0)
+        if self.wav is not None:
+            self.wav.close()
+
+def open_sink(spec: str, rate: int, device=None) -> _Sink:
+    # spec: "sounddevice", "null", or "wav:<path>"
+    if spec == "null":
+        return NullSink(rate)
+    if spec.startswith("wav:"):
+        return NullSink(rate, wav_path=spec[4:])
+    return DeviceSink(rate, device=device)
@@ -1,25 +1,93 @@
-import os, time, json, requests, re, uuid
+import os, time, json, re, uuid, threading
+_T0 = time.time()
 from pathlib import Path
 try:
     import RPi.GPIO as GPIO; ON_PI = True
 except Exception:
     GPIO = None; ON_PI = False
-from STT import SpeechToText
+from STT import SpeechToText, Vad
 import TTS
+import turn_trace
 
 MEM_DIR = Path("memory")
 MEM_DIR.mkdir(parents=True, exist_ok=True)
 
 BUTTON_PIN = 17
 LLM_SERVER_URL = "http://192.168.2.31:5000/talk"
+LLM_STREAM_URL = "http://192.168.2.31:5000/talk_stream"
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
+LLM_PREFETCH_URL = "http://192.168.2.31:5000/prefetch"
+LLM_WARM_URL = "http://192.168.2.31:5000/warm"
+LLM_UNREACHABLE_REPLY = "Sorry, I couldn't reach the AI server."
+LLM_SPECULATE = os.getenv("LLM_SPECULATE", "1") == "1"
+SPECULATE_MIN_WORDS = int(os.getenv("LLM_SPECULATE_MIN_WORDS", "2"))
 LOG_PATH = "memory/conversation_log.txt"
 SETTINGS_PATH = Path("memory/settings.json")
 
 VOSK_MODEL_EN = "sst_models/vosk-model-english"
 VOSK_MODEL_DE = "sst_models/vosk-model-german"
 SAMPLERATE = 16000
-BLOCKSIZE  = 8000
+BLOCKSIZE  = 800   # 50 ms capture blocks; STT batches them adaptively
+_HTTP = None
+_HTTP_LOCK = threading.Lock()
+HANDS_FREE = os.getenv("STT_HANDS_FREE", "0") == "1"   # no button: listen whenever Bjoern is quiet
+STT_AUTO_LANG = os.getenv("STT_AUTO_LANG", "0") == "1"  # decode English and German, keep the likelier one
+STT_VAD = HANDS_FREE or os.getenv("STT_VAD", "0") == "1"  # end the turn on trailing silence
 DEFAULT_STT_DEVICE = None if ON_PI else int(os.getenv("STT_DEVICE", "2"))
+STARTUP_WAIT_S = float(os.getenv("STARTUP_WAIT_S", "30"))  # how long the boot report waits for the TTS/LLM warm-up
+
+def _http():
+    # requests is only imported on first use, i.e. in the startup warm-up thread, not at boot.
+    global _HTTP
+    with _HTTP_LOCK:
+        if _HTTP is None:
+            import transport
+            _HTTP = transport.make_session(pool_size=2)
+        return _HTTP
+
+class Startup:
+    # Runs boot stages in parallel threads and reports how long each took, so boot-to-ready
+    # time on the Pi can be tracked.
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, *args):
+        st = self.stages[name] = {"start": time.time(), "end": None, "result": None, "error": None}
+        def work():
+            try: st["result"] = fn(*args)
+            except Exception as e: st["error"] = e
+            finally: st["end"] = time.time()
+        st["thread"] = threading.Thread(target=work, daemon=True)
+        st["thread"].start()
+
+    def result(self, name, timeout=None):
+        st = self.stages[name]
+        st["thread"].join(timeout)
+        if st["error"] is not None: raise st["error"]
+        return st["result"]
+
+    def wait(self, names, timeout):
+        # Joins the stages against one shared deadline; their errors show up in report().
+        deadline = time.time() + timeout
+        for name in names:
+            self.stages[name]["thread"].join(max(0.0, deadline - time.time()))
+
+    def report(self, ready_at=None):
+        ready_at = ready_at or time.time()
+        first = min((st["start"] for st in self.stages.values()), default=ready_at)
+        print(f"[Startup] imports        {first - _T0:6.2f}s")
+        for name, st in self.stages.items():
+            end = st["end"]
+            took = f"{end - st['start']:6.2f}s" if end else "  (running)"
+            status = "error: " + str(st["error"]) if st["error"] else ("ok" if end else "")
+            print(f"[Startup] {name:<14} {took}  +{st['start'] - _T0:.2f}s  {status}")
+        print(f"[Startup] boot-to-ready  {ready_at - _T0:6.2f}s")
+
+def warm_llm():
+    # Starts Ollama on the server and loads the model so the first turn is not a cold start.
+    r = _http().post(LLM_WARM_URL, timeout=120)
+    r.raise_for_status()
+    return r.json()
 
 def get_session_id():
     p = Path("memory/session_id.txt")
@@ -59,10 +127,43 @@ class Button:
     def cleanup(self):
         if ON_PI: GPIO.cleanup()
 
-def _record_on_next_press(stt, button):
+def _make_vad():
+    return Vad(
+        samplerate=SAMPLERATE,
+        threshold_db=float(os.getenv("VAD_THRESHOLD_DB", "-45")),
+        min_speech_ms=int(os.getenv("VAD_MIN_SPEECH_MS", "200")),
+        hangover_ms=int(os.getenv("VAD_HANGOVER_MS", "600")),
+        wake=HANDS_FREE,
+        use_vosk_endpoint=os.getenv("VAD_VOSK_ENDPOINT", "1") == "1",
+    )
+
+def _record_on_next_press(stt, button, on_partial=None, detect=False, turn=None):
+    # Returns the transcript, or (transcript, language) with detect=True.
+    transcribe = stt.transcribe_detect if detect else stt.transcribe_until
+    if HANDS_FREE:
+        # Wake on speech; wait for Bjoern to finish first so he does not hear himself.
+        TTS.wait_until_done(30)
+        t0 = time.time()
+        result = transcribe(lambda: False, on_partial=on_partial, vad=_make_vad())
+        turn_trace.emit("bear", turn, "listen", t0, time.time())
+        return result
     button.wait_for_press()
-    if ON_PI and not button.is_pressed(): return ""
-    return stt.transcribe_until(button.stop_condition)
+    t_press = time.time()
+    # Barge-in: pressing the button while Bjoern is still talking cuts him off.
+    if TTS.is_speaking(): TTS.cancel()
+    if ON_PI and not button.is_pressed(): return ("", stt.language) if detect else ""
+    released = []
+    def stop():
+        if button.stop_condition():
+            if not released: released.append(time.time())
+            return True
+        return False
+    result = transcribe(stop, on_partial=on_partial, vad=_make_vad() if STT_VAD else None)
+    t_final = time.time()
+    t_release = released[0] if released else t_final  # a VAD endpoint ends the turn before release
+    turn_trace.emit("bear", turn, "record", t_press, t_release)
+    turn_trace.emit("bear", turn, "stt_final", t_release, t_final)
+    return result
 
 def _detect_language_word(text):
     t = (text or "").strip().lower()
@@ -73,10 +174,14 @@ def _detect_language_word(text):
 def choose_language_via_voice(stt, button):
     TTS.speak("Hello! What language should I use: German or English?", "en")
     while True:
-        spoken = _record_on_next_press(stt, button)
+        if STT_AUTO_LANG:
+            # Any answer will do: the language it was spoken in counts as much as the word.
+            spoken, heard = _record_on_next_press(stt, button, detect=True)
+        else:
+            spoken, heard = _record_on_next_press(stt, button), ""
         if not spoken:
             TTS.speak("I didn't hear anything. Please say German or English.", "en"); continue
-        lang = _detect_language_word(spoken)
+        lang = _detect_language_word(spoken) or heard
         if not lang:
             TTS.speak("Sorry, I didn't understand. Please say German or English.", "en"); continue
         if lang == "de": TTS.speak("Okay, dann spreche ich nun Deutsch.", "de")
@@ -106,27 +211,108 @@ def ask_user_name(stt, button, language):
     if language == "de": TTS.speak("Ich nenne dich Freund.", "de"); return "Freund"
     TTS.speak("I'll call you Friend.", "en"); return "Friend"
 
-def send_to_llm(text, language, session_id, user_name):
+def _busy_reply(r):
+    # The server answers an overloaded queue with 503 and a speakable, localized reply marked
+    # "busy". Other 503s (Ollama down) carry a technical message and go to the generic fallback.
+    if r.status_code != 503: return ""
+    try: body = r.json()
+    except ValueError: return ""
+    return (body.get("reply") or "").strip() if body.get("busy") else ""
+
+def send_to_llm(text, language, session_id, user_name, turn=None):
     try:
-        r = requests.post(LLM_SERVER_URL, json={
-            "text": text, "language": language, "session_id": session_id, "user_name": user_name
+        r = _http().post(LLM_SERVER_URL, json={
+            "text": text, "language": language, "session_id": session_id, "user_name": user_name, "turn_id": turn
         }, timeout=60)
+        busy = _busy_reply(r)
+        if busy: return busy
         r.raise_for_status()
         return (r.json().get("reply") or "").strip()
     except Exception as e:
         print("[LLM] Error:", e)
-        return "Sorry, I couldn't reach the AI server."
+        return LLM_UNREACHABLE_REPLY
+
+def make_speculator(language, session_id, user_name):
+    # on_partial callback for transcribe_until(): posts the newest partial transcript to
+    # /prefetch from a background thread so the recording loop never waits on the network.
+    # on_partial.stop() must run before the final /talk so no partial arrives after it.
+    state = {"pending": None, "sent": "", "thread": None, "closed": False}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                text = state["pending"]; state["pending"] = None
+                if text is None or state["closed"]: state["thread"] = None; return
+            try:
+                _http().post(LLM_PREFETCH_URL, json={
+                    "text": text, "language": language, "session_id": session_id, "user_name": user_name
+                }, timeout=2)
+            except Exception:
+                pass
+
+    def on_partial(text):
+        if len(text.split()) < SPECULATE_MIN_WORDS or text == state["sent"]: return
+        with lock:
+            if state["closed"]: return
+            state["pending"] = state["sent"] = text
+            if state["thread"]: return
+            state["thread"] = threading.Thread(target=worker, daemon=True)
+            state["thread"].start()
+
+    def stop():
+        with lock:
+            state["closed"] = True; state["pending"] = None
+            t = state["thread"]
+        if t: t.join(3)
+
+    on_partial.stop = stop
+    return on_partial
+
+def stream_from_llm(text, language, session_id, user_name, on_sentence, turn=None):
+    # Hands each sentence to on_sentence as soon as the server sends it. Returns the full reply,
+    # or None when nothing was spoken and the caller should fall back to send_to_llm().
+    spoken = []
+    try:
+        with _http().post(LLM_STREAM_URL, json={
+            "text": text, "language": language, "session_id": session_id, "user_name": user_name, "turn_id": turn
+        }, stream=True, timeout=60) as r:
+            if r.status_code == 503:
+                # Busy, or Ollama down: retrying with send_to_llm() would only wait again.
+                reply = _busy_reply(r) or LLM_UNREACHABLE_REPLY
+                on_sentence(reply); return reply
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line: continue
+                msg = json.loads(line)
+                if msg.get("sentence"):
+                    spoken.append(msg["sentence"]); on_sentence(msg["sentence"])
+                if msg.get("done"):
+                    if msg.get("error"):
+                        print("[LLM] Error:", msg["error"]); break
+                    return (msg.get("reply") or " ".join(spoken)).strip()
+    except Exception as e:
+        print("[LLM] Stream error:", e)
+    return " ".join(spoken) if spoken else None
 
 def main():
-    button = Button(BUTTON_PIN)
-    session_id = get_session_id()
+    startup = Startup()
     settings = load_settings()
-    stt = SpeechToText(
+    startup.run("vosk", lambda: SpeechToText(
         model_path_en=VOSK_MODEL_EN, model_path_de=VOSK_MODEL_DE,
         samplerate=SAMPLERATE, blocksize=BLOCKSIZE,
         language=settings.get("language") or "en",
-        device=DEFAULT_STT_DEVICE,
-    )
+        device=DEFAULT_STT_DEVICE, preload=True,
+    ))
+    known = settings.get("language") in ("en", "de") and not STT_AUTO_LANG
+    startup.run("tts", TTS.warm, [settings["language"]] if known else ["en", "de"])
+    startup.run("llm", warm_llm)
+    button = Button(BUTTON_PIN)
+    session_id = get_session_id()
+    stt = startup.result("vosk")
+    # Boot-to-ready is measured here, before the language and name dialogs wait for the user.
+    startup.wait(("tts", "llm"), STARTUP_WAIT_S)
+    startup.report()
     lang = settings.get("language") or ""
     if lang not in ("en","de"):
         print("Starting language setup…")
@@ -145,14 +331,35 @@ def main():
     try:
         while True:
             print("Hold ↑ (or button) to talk…")
-            text = _record_on_next_press(stt, button)
+            on_partial = make_speculator(lang, session_id, user_name) if LLM_SPECULATE else None
+            turn = turn_trace.new_turn_id()
+            if STT_AUTO_LANG:
+                text, spoken_lang = _record_on_next_press(stt, button, on_partial, detect=True, turn=turn)
+                if text and spoken_lang != lang:
+                    print(f"[Lang] {lang} -> {spoken_lang}")
+                    lang = settings["language"] = spoken_lang; save_settings(settings)
+                    stt.set_language(lang)
+            else:
+                text = _record_on_next_press(stt, button, on_partial, turn=turn)
+            if on_partial: on_partial.stop()
             if text:
                 print(f"You: {text}")
-                reply = send_to_llm(text, lang, session_id, user_name)
-                print(f"AI:   {reply}")
-                if reply.strip(): TTS.speak(reply, language=lang)
+                reply = None
+                t_send, first = time.time(), []
+                def say(s):
+                    if not first: first.append(time.time())
+                    TTS.speak(s, language=lang, turn=turn)
+                if LLM_STREAM:
+                    reply = stream_from_llm(text, lang, session_id, user_name, say, turn=turn)
+                    if reply is not None: print(f"AI:   {reply}")
+                if reply is None:
+                    reply = send_to_llm(text, lang, session_id, user_name, turn=turn)
+                    print(f"AI:   {reply}")
+                    if reply.strip(): say(reply)
+                turn_trace.emit("bear", turn, "llm", t_send, time.time(), streamed=LLM_STREAM,
+                                first_sentence_ms=round((first[0] - t_send) * 1000.0, 1) if first else None)
                 with open(LOG_PATH, "a", encoding="utf-8") as f:
-                    f.write(json.dumps({"user": user_name, "lang": lang, "input": text, "reply": reply}) + "\n")
+                    f.write(json.dumps({"user": user_name, "lang": lang, "input": text, "reply": reply, "turn": turn}) + "\n")
             else:
                 print("No speech detected.")
             time.sleep(0.2)
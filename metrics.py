@@ -0,0 +1,95 @@
+import threading
+from bisect import bisect_left
+
+# Minimal Prometheus text exposition (format 0.0.4) without the prometheus_client dependency.
+# Recording a value takes one short lock and, for histograms, a bisect over a few buckets, so the
+# collectors stay on under load. Values that already live elsewhere (sessions, scheduler, reply
+# cache) are not tracked per request; the server passes them to render() at scrape time.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(v):
+    return str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+def _fmt_labels(pairs):
+    pairs = list(pairs)
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+def _fmt_value(v):
+    if v == float("inf"): return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name; self.help = help; self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # label values tuple -> value
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(k, "")) for k in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        if not self.labels: self._values[()] = 0  # exposed as 0 before the first inc()
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        with self._lock: self._values[key] = self._values.get(key, 0) + n
+
+    def lines(self):
+        with self._lock: items = sorted(self._values.items())
+        return [f"{self.name}{_fmt_labels(zip(self.labels, k))} {_fmt_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        if not self.labels: self._values[()] = self._zero()
+
+    def _zero(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]  # per-bucket counts, +Inf, then the sum
+
+    def observe(self, v, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, v)  # first bucket with upper bound >= v; len(buckets) is +Inf
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None: counts = self._values[key] = self._zero()
+            counts[i] += 1; counts[-1] += v
+
+    def lines(self):
+        with self._lock: items = sorted((k, list(c)) for k, c in self._values.items())
+        out = []
+        for key, counts in items:
+            pairs = list(zip(self.labels, key)); total = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                total += n
+                out.append(f"{self.name}_bucket{_fmt_labels(pairs + [('le', _fmt_value(float(bound)))])} {total}")
+            out.append(f"{self.name}_sum{_fmt_labels(pairs)} {_fmt_value(counts[-1])}")
+            out.append(f"{self.name}_count{_fmt_labels(pairs)} {total}")
+        return out
+
+REGISTRY = []
+
+def render(extra=()):
+    # extra: (name, type, help, value) for gauges and counters read at scrape time; value is a
+    # number or a list of (labels dict, number).
+    out = []
+    for m in REGISTRY:
+        out += m.header() + m.lines()
+    for name, kind, help, value in extra:
+        out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        for labels, v in (value if isinstance(value, list) else [({}, value)]):
+            out.append(f"{name}{_fmt_labels(sorted(labels.items()))} {_fmt_value(v)}")
+    return "\n".join(out) + "\n"
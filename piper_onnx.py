@@ -0,0 +1,97 @@
+import os, json, subprocess, shutil, threading, unicodedata
+import numpy as np
+import onnxruntime as ort
+
+try:
+    from piper_phonemize import phonemize_espeak
+except ImportError:  # falls back to the espeak-ng command line
+    phonemize_espeak = None
+
+ESPEAK_BIN = os.environ.get("ESPEAK_BIN", "espeak-ng")
+ESPEAK_DATA = os.environ.get("ESPEAK_DATA")
+
+_BOS, _EOS, _PAD = "^", "$", "_"
+
+_opts_lock = threading.Lock()
+_opts = None
+
+def _session_options(threads: int):
+    # One set of options for every voice in the process. Sessions draw from a single shared
+    # CPU arena, so loading a second voice does not reserve a second arena.
+    global _opts
+    with _opts_lock:
+        if _opts is None:
+            _opts = ort.SessionOptions()
+            _opts.intra_op_num_threads = max(1, threads)
+            _opts.inter_op_num_threads = 1
+            _opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            try:
+                mem = ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT)
+                ort.create_and_register_allocator(mem, None)
+                _opts.add_session_config_entry("session.use_env_allocators", "1")
+            except Exception:
+                pass
+        return _opts
+
+def _espeak_cli(text: str, voice: str):
+    cmd = [ESPEAK_BIN, "-q", "--ipa", "-v", voice]
+    if ESPEAK_DATA:
+        cmd += ["--path", ESPEAK_DATA]
+    out = subprocess.run(cmd + [text], capture_output=True, timeout=10)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.decode("utf-8", "ignore").strip() or "espeak-ng failed")
+    lines = [l.strip() for l in out.stdout.decode("utf-8", "ignore").splitlines() if l.strip()]
+    return [list(" ".join(lines))]
+
+class PiperVoice:
+    # A Piper .onnx voice run in-process: text -> espeak phonemes -> ids -> int16 PCM. Uses the
+    # same .onnx.json config the piper binary reads (sample rate, phoneme ids, inference scales).
+    def __init__(self, model_path: str, threads: int = 2):
+        with open(model_path + ".json", "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        self.sample_rate = int((cfg.get("audio") or {}).get("sample_rate", 22050))
+        self.espeak_voice = (cfg.get("espeak") or {}).get("voice", "en-us")
+        self.id_map = cfg.get("phoneme_id_map") or {}
+        self.phoneme_map = cfg.get("phoneme_map") or {}
+        inf = cfg.get("inference") or {}
+        self.scales = np.array([inf.get("noise_scale", 0.667), inf.get("length_scale", 1.0), inf.get("noise_w", 0.8)],
+                               dtype=np.float32)
+        self.multi_speaker = int(cfg.get("num_speakers", 1)) > 1
+        if phonemize_espeak is None and not shutil.which(ESPEAK_BIN):
+            raise RuntimeError("neither piper_phonemize nor espeak-ng is available")
+        self.session = ort.InferenceSession(model_path, sess_options=_session_options(threads),
+                                            providers=["CPUExecutionProvider"])
+
+    def phonemize(self, text: str):
+        if phonemize_espeak is not None:
+            return phonemize_espeak(text, self.espeak_voice)
+        return _espeak_cli(text, self.espeak_voice)
+
+    def _ids(self, phonemes):
+        ids = list(self.id_map[_BOS]) + list(self.id_map[_PAD])
+        for p in unicodedata.normalize("NFD", "".join(phonemes)):
+            for q in self.phoneme_map.get(p, [p]):
+                if q in self.id_map:
+                    ids += self.id_map[q] + self.id_map[_PAD]
+        return ids + list(self.id_map[_EOS])
+
+    def synthesize(self, text: str, pause_s: float = 0.0) -> np.ndarray:
+        # Returns mono int16 samples at self.sample_rate; espeak's sentences are rendered one by one.
+        parts = []
+        gap = np.zeros(int(self.sample_rate * pause_s), dtype=np.int16)
+        for phonemes in self.phonemize(text):
+            ids = self._ids(phonemes)
+            feeds = {
+                "input": np.array([ids], dtype=np.int64),
+                "input_lengths": np.array([len(ids)], dtype=np.int64),
+                "scales": self.scales,
+            }
+            if self.multi_speaker:
+                feeds["sid"] = np.array([0], dtype=np.int64)
+            audio = self.session.run(None, feeds)[0].squeeze()
+            # Same peak normalisation as piper's audio_float_to_int16.
+            audio = audio * (32767.0 / max(0.01, float(np.max(np.abs(audio)))))
+            parts.append(np.clip(audio, -32768, 32767).astype(np.int16))
+            if gap.size:
+                parts.append(gap)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int16)
@@ -0,0 +1,83 @@
+import threading, time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+class Busy(Exception):
+    pass
+
+class FairScheduler:
+    # Admission control in front of a backend that handles `limit` requests at a time. Waiters
+    # queue per key (session) and freed slots are handed out round-robin across keys, so one
+    # chatty bear cannot starve the others. Requests that cannot start within their deadline,
+    # or that find the queue full, fail fast with Busy instead of timing out downstream.
+    def __init__(self, limit=1, max_queue=8, deadline=20.0):
+        self.limit = max(1, limit); self.max_queue = max_queue; self.deadline = deadline
+        self._lock = threading.Lock()
+        self._active = 0; self._queued = 0
+        self._queues = OrderedDict()  # key -> deque of waiting Events, in round-robin order
+        self._avg_service = None      # moving average of how long a slot is held
+        self.admitted = 0; self.rejected = 0
+        self.wait_total = 0.0; self.wait_max = 0.0
+
+    def _estimated_wait(self):
+        if self._avg_service is None: return 0.0
+        return self._avg_service * ((self._queued // self.limit) + 1)
+
+    def _admitted(self, waited):
+        self.admitted += 1; self.wait_total += waited; self.wait_max = max(self.wait_max, waited)
+
+    def try_acquire(self):
+        # Takes a free slot only if nobody is waiting; used for low-priority work.
+        with self._lock:
+            if self._active < self.limit and not self._queued:
+                self._active += 1; self._admitted(0.0); return True
+            return False
+
+    def acquire(self, key, deadline=None):
+        deadline = self.deadline if deadline is None else deadline
+        t0 = time.time()
+        with self._lock:
+            if self._active < self.limit and not self._queued:
+                self._active += 1; self._admitted(0.0); return
+            if self._queued >= self.max_queue or self._estimated_wait() > deadline:
+                self.rejected += 1; raise Busy()
+            ev = threading.Event()
+            self._queues.setdefault(key, deque()).append(ev); self._queued += 1
+        granted = ev.wait(deadline)
+        with self._lock:
+            if granted or ev.is_set():
+                self._admitted(time.time() - t0); return
+            q = self._queues.get(key)
+            if q is not None:
+                q.remove(ev); self._queued -= 1
+                if not q: del self._queues[key]
+            self.rejected += 1
+        raise Busy()
+
+    def release(self, held_for=None):
+        with self._lock:
+            if held_for is not None:
+                self._avg_service = held_for if self._avg_service is None else 0.8 * self._avg_service + 0.2 * held_for
+            if not self._queued:
+                self._active -= 1; return
+            # Hand the slot straight to the next session in rotation; _active stays the same.
+            key, q = self._queues.popitem(last=False)
+            ev = q.popleft(); self._queued -= 1
+            if q: self._queues[key] = q
+            ev.set()
+
+    @contextmanager
+    def slot(self, key, deadline=None):
+        self.acquire(key, deadline)
+        t0 = time.time()
+        try: yield
+        finally: self.release(time.time() - t0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit, "active": self._active, "queued": self._queued,
+                "admitted": self.admitted, "rejected": self.rejected,
+                "wait_avg_s": self.wait_total / self.admitted if self.admitted else 0.0,
+                "wait_max_s": self.wait_max, "service_avg_s": self._avg_service or 0.0,
+            }
@@ -0,0 +1,117 @@
+import sqlite3, threading, queue, json, time, sys
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    item TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_session_ts ON turns(session_id, ts, id);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    last_ts REAL NOT NULL,
+    turns INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+class SqliteStore:
+    # Session history in one SQLite database (WAL mode). Appends are queued and written by a
+    # single thread in batched transactions; readers use their own per-thread connections.
+    def __init__(self, path, batch_size=64, flush_ms=200):
+        self.path = str(path)
+        self.batch_size = batch_size; self.flush_s = flush_ms / 1000.0
+        self._q = queue.Queue(); self._local = threading.local()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL"); db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def append(self, session_id, item):
+        self._q.put((session_id, item))
+
+    def flush(self):
+        self._q.join()
+
+    def _writer(self):
+        db = self._connect()
+        while True:
+            batch = [self._q.get()]
+            deadline = time.time() + self.flush_s
+            while len(batch) < self.batch_size:
+                try: batch.append(self._q.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty: break
+            try:
+                self._write(db, batch)
+            except Exception as e:
+                print("[STORE] write failed:", e, file=sys.stderr)
+            finally:
+                for _ in batch: self._q.task_done()
+
+    @staticmethod
+    def _write(db, batch):
+        rows = [(sid, float(item.get("ts") or time.time()), json.dumps(item, ensure_ascii=False)) for sid, item in batch]
+        with db:
+            db.executemany("INSERT INTO turns(session_id, ts, item) VALUES (?,?,?)", rows)
+            db.executemany(
+                "INSERT INTO sessions(session_id, last_ts, turns) VALUES (?,?,1) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_ts=MAX(last_ts, excluded.last_ts), turns=turns+1",
+                [(sid, ts) for sid, ts, _ in rows])
+
+    def load_tail(self, session_id, n):
+        self.flush()  # queued appends must be visible to a cold load
+        cur = self._reader().execute(
+            "SELECT item FROM turns WHERE session_id=? ORDER BY ts DESC, id DESC LIMIT ?", (session_id, n))
+        return [json.loads(r[0]) for r in reversed(cur.fetchall())]
+
+    def sessions(self, offset, limit):
+        cur = self._reader().execute(
+            "SELECT session_id FROM sessions ORDER BY session_id LIMIT ? OFFSET ?", (limit, offset))
+        return [r[0] for r in cur]
+
+    def rows(self, session_id, offset, limit):
+        cur = self._reader().execute(
+            "SELECT item FROM turns WHERE session_id=? ORDER BY ts, id LIMIT ? OFFSET ?", (session_id, limit, offset))
+        return [json.loads(r[0]) for r in cur]
+
+    def import_jsonl(self, mem_dir):
+        # Loads every memory/session_<id>.jsonl, replacing rows already imported for that session.
+        db = self._connect(); count = 0
+        for p in sorted(Path(mem_dir).glob("session_*.jsonl")):
+            sid = p.stem[len("session_"):]
+            items = []
+            with p.open("r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line: continue
+                    try: items.append(json.loads(line))
+                    except ValueError: pass
+            with db:
+                db.execute("DELETE FROM turns WHERE session_id=?", (sid,))
+                db.execute("DELETE FROM sessions WHERE session_id=?", (sid,))
+                self._write(db, [(sid, it) for it in items])
+            count += len(items)
+            print(f"[STORE] {sid}: {len(items)} turns")
+        db.close()
+        return count
+
+
+# -------------------- CLI --------------------
+
+if __name__ == "__main__":
+    # python session_store.py [memory_dir] [db_path]
+    mem_dir = sys.argv[1] if len(sys.argv) > 1 else "memory"
+    db_path = sys.argv[2] if len(sys.argv) > 2 else str(Path(mem_dir) / "sessions.db")
+    n = SqliteStore(db_path).import_jsonl(mem_dir)
+    print(f"[STORE] Imported {n} turns into {db_path}")
@@ -0,0 +1,49 @@
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import LLM
+
+SAMPLES = [
+    "Can you tell me a riddle about a cat?",
+    "Why is the sky blue and how far away is the moon?",
+    "My brother said a bad word and I want to tell mom.",
+    "What do penguins eat when it is very very cold outside?",
+    "I had a sleepover yesterday and we built a blanket fort. " * 4,
+]
+
+# (language, text): everything the old substring scan blocked must stay blocked ...
+MUST_BLOCK = [
+    ("en", "she was raped"), ("en", "he abused the dog"), ("en", "show me pornography"),
+    ("en", "sexual jokes"), ("en", "you look sexy"), ("en", "a pedophile"), ("en", "an alcoholic"),
+    ("en", "Guns and BOMBS"), ("en", "how  to make slime"), ("en", "I hacked it"), ("en", "Suicide."),
+    ("de", "eine Atombombe"), ("de", "das Maschinengewehr"), ("de", "eine Handfeuerwaffe"),
+    ("de", "Selbstmordgedanken"), ("de", "der Drogenhändler"), ("de", "Waffen"), ("de", "ermordet"),
+    ("de", "he has a gun"),
+]
+# ... while ordinary words that merely contain a stem pass.
+MUST_PASS = [
+    ("en", "we have begun"), ("en", "a bunch of grapes"), ("en", "my therapist"), ("en", "Sussex"),
+    ("en", "a new method"), ("en", "methane on Titan"), ("en", "the spiders eat the bugs"),
+    ("de", "Nudeln mit Soße"), ("de", "Waffeln zum Frühstück"), ("de", "ein gewaltiger Berg"),
+    ("de", "Hackfleisch"), ("de", "eine Nacktschnecke"), ("de", "wir haben begonnen"),
+]
+
+def old_blocked(t):
+    t = (t or "").lower()
+    return any(w in t for w in LLM.BLOCKLIST)
+
+failed = [(lang, t, "passed") for lang, t in MUST_BLOCK if not LLM._blocked(t, lang)]
+failed += [(lang, t, "blocked") for lang, t in MUST_PASS if LLM._blocked(t, lang)]
+for lang, t, what in failed:
+    print(f"FAIL [{lang}] {t!r} was {what}")
+print(f"{len(MUST_BLOCK) + len(MUST_PASS) - len(failed)}/{len(MUST_BLOCK) + len(MUST_PASS)} table cases ok")
+
+N = 20000
+old = timeit.timeit(lambda: [old_blocked(t) for t in SAMPLES], number=N)
+new = timeit.timeit(lambda: [LLM._blocked(t, "en") for t in SAMPLES], number=N)
+per = N * len(SAMPLES)
+print(f"substring scan: {old / per * 1e6:.2f} µs/text")
+print(f"compiled regex: {new / per * 1e6:.2f} µs/text ({old / new:.1f}x)")
+sys.exit(1 if failed else 0)
@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Turns answered without Ollama (blocked input, reply-cache hit) must not leave a speculation
+# from the turn's partials running on the scheduler slot. Runs LLM.py against a stand-in for
+# Ollama's streaming /api/generate, so no model is needed.
+
+class FakeOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a):
+        pass
+
+    def do_GET(self):  # /api/tags health check
+        body = b'{"models":[]}'
+        self.send_response(200); self.send_header("Content-Length", str(len(body))); self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):  # /api/generate: a slow NDJSON token stream
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200); self.send_header("Transfer-Encoding", "chunked"); self.end_headers()
+        try:
+            for i in range(20):
+                line = (json.dumps({"response": f"word{i} "}) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line)); self.wfile.flush()
+                time.sleep(0.2)
+            line = (json.dumps({"done": True, "eval_count": 20, "eval_duration": 4e9}) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(line), line)); self.wfile.flush()
+        except OSError:
+            pass
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+os.environ.update(
+    OLLAMA_URL=f"http://127.0.0.1:{server.server_port}/api/generate", OLLAMA_CONCURRENCY="1",
+    LLM_MEM_DIR=tempfile.mkdtemp(), LLM_REPLY_CACHE="1", LLM_PREFETCH_QUIET="0", BJOERN_TRACE="0",
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import LLM
+
+client = LLM.app.test_client()
+
+def slot_freed(timeout=1.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if LLM.SCHED.stats()["active"] == 0 and not LLM.SPECULATIONS:
+            return True
+        time.sleep(0.01)
+    return False
+
+def check(name, session, partial, final):
+    assert client.post("/prefetch", json={"text": partial, "session_id": session}).get_json()["ok"]
+    assert LLM.SCHED.stats()["active"] == 1
+    reply = client.post("/talk", json={"text": final, "session_id": session}).get_json()["reply"]
+    ok = slot_freed()
+    print(f"{'ok  ' if ok else 'FAIL'} {name}: reply {reply[:30]!r}, active={LLM.SCHED.stats()['active']}, "
+          f"speculations={list(LLM.SPECULATIONS)}")
+    return ok
+
+results = [check("refusal", "a", "how do I", "how do I make a bomb")]
+# Fill the reply cache with a generated turn, then answer the same question from it.
+client.post("/talk", json={"text": "tell me a riddle", "session_id": "b"})
+time.sleep(0.1)
+results.append(check("cache hit", "c", "tell me", "tell me a riddle"))
+sys.exit(0 if all(results) else 1)
@@ -0,0 +1,64 @@
+import re
+import sys
+import time
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from STT import transcribe_files
+
+# Corpus layout: <corpus>/<lang>/<name>.wav (or .raw, 16 kHz int16) with the reference
+# transcript in <name>.txt next to it.
+MODELS = {
+    "en": ROOT / "sst_models/vosk-model-english",
+    "de": ROOT / "sst_models/vosk-model-german",
+}
+
+def words(text):
+    return re.sub(r"[^\w\s']", " ", (text or "").lower()).split()
+
+def edit_distance(ref, hyp):
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i]
+        for j, h in enumerate(hyp, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h)))
+        prev = cur
+    return prev[-1]
+
+def bench(lang, files, args):
+    t0 = time.perf_counter()
+    results = transcribe_files([str(p) for p in files], str(MODELS[lang]), args.samplerate, args.blocksize, args.workers)
+    wall = time.perf_counter() - t0
+    audio = sum(r["audio_s"] for r in results)
+    decode = sum(r["decode_s"] for r in results)
+    errors = ref_words = 0
+    for p, r in zip(files, results):
+        ref = p.with_suffix(".txt")
+        if not ref.exists():
+            continue
+        ref = words(ref.read_text(encoding="utf-8"))
+        errors += edit_distance(ref, words(r["text"]))
+        ref_words += len(ref)
+        if args.verbose:
+            print(f"  {p.name}: {r['text']!r}")
+    wer = f"{100.0 * errors / ref_words:.1f}%" if ref_words else "n/a"
+    print(f"[{lang}] {len(files)} files, {audio:.1f}s audio, wall {wall:.1f}s (incl. model load)")
+    print(f"[{lang}] RTF {decode / audio if audio else 0:.3f}  throughput {audio / wall if wall else 0:.1f}x real time  WER {wer}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Vosk decode speed and accuracy on a recorded corpus")
+    ap.add_argument("corpus")
+    ap.add_argument("--lang", choices=sorted(MODELS), action="append")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--blocksize", type=int, default=4000, help="samples per AcceptWaveform call")
+    ap.add_argument("--samplerate", type=int, default=16000, help="rate of .raw files")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+    for lang in args.lang or sorted(MODELS):
+        files = sorted(p for p in (Path(args.corpus) / lang).glob("*") if p.suffix in (".wav", ".raw"))
+        if files:
+            bench(lang, files, args)
+        else:
+            print(f"[{lang}] no audio in {Path(args.corpus) / lang}")
@@ -0,0 +1,48 @@
+import threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def make_session(pool_size=4, retries=2, backoff=0.3):
+    # Keep-alive session with a shared connection pool. Only connection failures are retried
+    # (read/status retries are off), so a POST that reached the server is never sent twice.
+    retry = Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                  backoff_factor=backoff, allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter); s.mount("https://", adapter)
+    return s
+
+class HealthMonitor:
+    # Polls url in a background thread and caches the answer, so request paths read `alive`
+    # instead of paying a round trip. Callers that see a connection error call mark_down().
+    def __init__(self, url, session=None, interval=5.0, timeout=1.0):
+        self.url = url
+        self.session = session or make_session(pool_size=1, retries=0)
+        self.interval = interval; self.timeout = timeout
+        self.alive = False; self.checked_at = 0.0
+        self.epoch = 0  # bumped on every down -> up transition, i.e. each (re)start of the service
+        self._thread = None; self._lock = threading.Lock()
+
+    def check(self):
+        try:
+            self.session.get(self.url, timeout=self.timeout).raise_for_status(); ok = True
+        except requests.exceptions.RequestException:
+            ok = False
+        if ok and not self.alive: self.epoch += 1
+        self.alive, self.checked_at = ok, time.time()
+        return ok
+
+    def mark_down(self):
+        self.alive = False
+
+    def start(self):
+        with self._lock:
+            if self._thread: return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
@@ -0,0 +1,89 @@
+import os, sys, json, glob, math, uuid, threading
+from collections import defaultdict
+
+# Per-turn latency spans. The bear, the LLM server and the TTS daemon each append one JSON line
+# per span to <BJOERN_TRACE_DIR>/trace_<src>.jsonl, all tagged with the turn id the bear sends
+# along in /talk and in the TTS daemon requests. Off unless BJOERN_TRACE=1; each file is rotated
+# to trace_<src>.1.jsonl at BJOERN_TRACE_MAX_MB, so at most about twice that stays on disk per source.
+TRACE_ON = os.environ.get("BJOERN_TRACE", "0") == "1"
+TRACE_DIR = os.environ.get("BJOERN_TRACE_DIR", "memory")
+TRACE_MAX_BYTES = int(float(os.environ.get("BJOERN_TRACE_MAX_MB", "5")) * 1024 * 1024)
+
+_lock = threading.Lock()
+_files = {}  # src -> [open file, bytes written so far]
+
+def new_turn_id():
+    return uuid.uuid4().hex[:12]
+
+def emit(src, turn, span, t0, t1=None, **attrs):
+    # Times are wall-clock seconds, so spans from processes on the same machine line up;
+    # durations ("ms") are comparable across machines.
+    if not TRACE_ON or not turn:
+        return
+    t1 = t0 if t1 is None else t1
+    rec = dict(attrs, turn=turn, src=src, span=span, t0=round(t0, 4), t1=round(t1, 4), ms=round((t1 - t0) * 1000.0, 1))
+    try:
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        path = os.path.join(TRACE_DIR, f"trace_{src}.jsonl")
+        with _lock:
+            entry = _files.get(src)
+            if entry is None:
+                os.makedirs(TRACE_DIR, exist_ok=True)
+                f = open(path, "a", encoding="utf-8", buffering=1)
+                entry = _files[src] = [f, f.tell()]
+            entry[0].write(line)
+            entry[1] += len(line.encode("utf-8"))
+            if entry[1] >= TRACE_MAX_BYTES:
+                entry[0].close(); del _files[src]
+                os.replace(path, os.path.join(TRACE_DIR, f"trace_{src}.1.jsonl"))
+    except Exception as e:
+        print("[TRACE] write failed:", e, file=sys.stderr)
+
+
+# -------------------- Report --------------------
+
+def _percentile(values, p):
+    s = sorted(values)
+    return s[max(0, math.ceil(p / 100.0 * len(s)) - 1)]  # nearest rank
+
+def _load(paths):
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try: yield json.loads(line)
+                except ValueError: pass
+
+def _end_to_end(turns):
+    # Stages across processes on the bear (same clock): button release -> first/last audio.
+    out = defaultdict(list)
+    for recs in turns.values():
+        release = next((r["t1"] for r in recs if r["src"] == "bear" and r["span"] in ("record", "listen")), None)
+        audio = [r for r in recs if r["src"] == "tts" and r["span"] == "utterance" and r.get("first_audio")]
+        if release is None or not audio:
+            continue
+        out["e2e.release_to_first_audio"].append((min(r["first_audio"] for r in audio) - release) * 1000.0)
+        out["e2e.release_to_last_audio"].append((max(r["t1"] for r in audio) - release) * 1000.0)
+    return out
+
+def report(paths):
+    stages, turns = defaultdict(list), defaultdict(list)
+    for r in _load(paths):
+        stages[f"{r['src']}.{r['span']}"].append(r["ms"])
+        turns[r["turn"]].append(r)
+    stages.update(_end_to_end(turns))
+    print(f"{len(turns)} turns")
+    print(f"{'stage':<32}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}   (ms)")
+    for name in sorted(stages, key=lambda n: (n.split(".")[0] != "e2e", n)):
+        v = stages[name]
+        print(f"{name:<32}{len(v):>6}{_percentile(v, 50):>10.0f}{_percentile(v, 95):>10.0f}{_percentile(v, 99):>10.0f}{max(v):>10.0f}")
+
+
+if __name__ == "__main__":
+    # python turn_trace.py [trace files or directories...]   (default: $BJOERN_TRACE_DIR)
+    args = sys.argv[1:] or [TRACE_DIR]
+    paths = []
+    for a in args:
+        paths += sorted(glob.glob(os.path.join(a, "trace_*.jsonl"))) if os.path.isdir(a) else [a]
+    if not paths:
+        raise SystemExit("no trace files found")
+    report(paths)